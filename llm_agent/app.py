@@ -7,10 +7,13 @@ loads global settings, and initializes the chat agent and the Webex bot manager.
 It defines a Pydantic model for the message data and two POST endpoints:
 one for sending messages to the chat agent and another for processing alerts.
 """
+# Imported first, the startup clock starts here
+from startup_timing import startup_timer
 import uvicorn
 import threading
-from fastapi import FastAPI
-from IPython.display import Image
+import requests
+from fastapi import FastAPI, Response
+from fastapi.responses import StreamingResponse
 from logging_config.main import setup_logging
 from load_global_settings import (
     HOST_URL,
@@ -19,24 +22,190 @@ from load_global_settings import (
 from webex.bot import WebexBotManager
 from langchain_core.messages import HumanMessage
 from llm_agent import create_agent_graph
+from typing import Optional
+from nwpi import device_inventory, trace_store, vmanage, vmanage_cache
+from vmanage_client import VManageAuthError
+from tool_budget import tool_pages
+from supervisor_routing import route_stats
+from llm_cache import llm_cache
+from chat_stream import sse, stream_chat_events
+from session_memory import session_memory
+from checkpoints import close_run, open_checkpointer, prune_threads, resume_pending, start_run, thread_config, thread_lock
+from request_budget import RequestBudget, budget_stats, with_budget
 
 from fastapi_models import Message, SnowWebhookMessage
 
+startup_timer.mark("imports", startup_timer.started)
+
+RESUMED_ANSWER = "Your previous request was interrupted, here is its answer:\n%s\n\nAnd the answer to your new message:\n%s"
 
 app = FastAPI()
 logger = setup_logging()
-chat_agent = create_agent_graph()
-webex_bot_manager = WebexBotManager()
+with startup_timer.phase("agent_graph"):
+    chat_agent = create_agent_graph()
+with startup_timer.phase("webex_bot"):
+    webex_bot_manager = WebexBotManager()
+
+
+@app.on_event("startup")
+async def open_checkpoints() -> None:
+    """
+    This function attaches the conversation checkpoints, they need the event loop of the app.
+    """
+    chat_agent.checkpointer = open_checkpointer()
+    await prune_threads(chat_agent.checkpointer)
+    startup_timer.log()
+
+
+@app.on_event("shutdown")
+async def close_checkpoints() -> None:
+    await chat_agent.checkpointer.conn.close()
+
+
+@app.on_event("startup")
+def start_vmanage_warm_up() -> None:
+    """
+    This function logs in to vManage in the background, so the app starts without waiting for it.
+    """
+    threading.Thread(target=warm_up_vmanage, daemon=True).start()
+
+
+def warm_up_vmanage() -> None:
+    """
+    Establishes the vManage session ahead of the first tool call. On failure the first tool call retries.
+    Then keeps the device inventory refreshed in the background.
+    """
+    try:
+        vmanage.ensure_login()
+        logger.info("VMANAGE_WARM_UP: session ready")
+    except (VManageAuthError, requests.RequestException) as e:
+        logger.warning(f"VMANAGE_WARM_UP_FAILED: {e}")
+    device_inventory.start()
+
+
+@app.get("/ready")
+def ready(response: Response) -> dict:
+    """
+    This function reports if the vManage session is established, 503 until it is.
+    """
+    if not vmanage.is_authenticated:
+        response.status_code = 503
+    return {"vmanage": vmanage.is_authenticated}
+
+def session_config(message: Message) -> dict:
+    """
+    Builds the graph config that scopes the agents memory to the session of the message.
+    The session is also the checkpoint thread, a message without a session gets a throwaway one.
+    """
+    return thread_config(message.session_id, message.session_id)
+
+async def finish_run(config: dict, message: Message) -> None:
+    """
+    Closes the checkpointed run. A message without a session leaves neither a run nor a memory behind.
+    """
+    await close_run(chat_agent, config, resumable=message.session_id is not None)
+    if message.session_id is None:
+        session_memory.clear(config["configurable"]["session_id"])
+
+
+async def resume_interrupted(config: dict) -> Optional[str]:
+    """
+    Finishes the interrupted run of the thread, if any, with a budget of its own.
+    Returns its answer, the new message is processed after it.
+    """
+    budget = RequestBudget()
+    try:
+        return await resume_pending(chat_agent, with_budget(config, budget))
+    finally:
+        if budget.llm_calls or budget.rounds:
+            budget_stats.record(budget)
 
 
 @app.post("/chat")
-def chat_to_llm(message: Message) -> str:
+async def chat_to_llm(message: Message) -> str:
     logger.info(f"MESSAGE_RECEIVED: {message.message}")
     formatted_message = {
         "input": [HumanMessage(content=message.message)],
     }
-    result = chat_agent.invoke(formatted_message)
-    return result['input'][-1].content
+    config = session_config(message)
+    # One request of a session at a time, the run of another one is not an interrupted run
+    async with thread_lock(config):
+        resumed = await resume_interrupted(config)
+        # Every request gets its own budget of supervisor rounds, tool calls, tokens and time
+        run_config = with_budget(config, RequestBudget())
+        await start_run(chat_agent, config)
+        try:
+            result = await chat_agent.ainvoke(formatted_message, config=run_config)
+        finally:
+            # A run interrupted here is resumed by the next message of the session
+            await finish_run(config, message)
+            budget_stats.record(run_config["configurable"]["budget"])
+    answer = result['input'][-1].content
+    if resumed is not None:
+        answer = RESUMED_ANSWER % (resumed, answer)
+    return answer
+
+@app.post("/chat/stream")
+async def chat_stream_to_llm(message: Message) -> StreamingResponse:
+    """
+    This function streams the progress of the chat as Server-Sent Events, ending with the "final" answer.
+    A "resumed" event first carries the answer of an interrupted previous request of the session.
+    """
+    logger.info(f"STREAM_MESSAGE_RECEIVED: {message.message}")
+    formatted_message = {
+        "input": [HumanMessage(content=message.message)],
+    }
+    config = session_config(message)
+
+    async def events():
+        async with thread_lock(config):
+            resumed = await resume_interrupted(config)
+            if resumed is not None:
+                yield sse("resumed", {"content": resumed})
+            await start_run(chat_agent, config)
+            try:
+                async for event in stream_chat_events(chat_agent, formatted_message, config=with_budget(config, RequestBudget())):
+                    yield event
+            finally:
+                await finish_run(config, message)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+@app.get("/metrics")
+def metrics() -> dict:
+    """
+    This function returns runtime counters of the assistant.
+    """
+    return {
+        "vmanage_cache": vmanage_cache.stats(),
+        "trace_store": trace_store.stats(),
+        "tool_pages": tool_pages.stats(),
+        "supervisor": route_stats.stats(),
+        "llm_cache": llm_cache.stats(),
+        "session_memory": session_memory.stats(),
+        "startup": startup_timer.report(),
+        "request_budget": budget_stats.stats(),
+    }
+
+@app.get("/trace-store")
+def trace_store_entries(limit: int = 50) -> dict:
+    """
+    This function lists the stored results of stopped traces, most recently read first.
+    """
+    return {"stats": trace_store.stats(), "entries": trace_store.entries(limit)}
+
+@app.delete("/trace-store")
+def trace_store_purge(trace_id: Optional[int] = None) -> dict:
+    """
+    This function deletes the stored results of one trace, or all of them when no trace_id is given.
+    """
+    deleted = trace_store.purge(trace_id)
+    logger.info(f"TRACE_STORE_PURGED: trace_id={trace_id} deleted={deleted}")
+    return {"deleted": deleted}
 
 @app.post("/alert")
 async def alert(message: SnowWebhookMessage) -> dict:
@@ -0,0 +1,83 @@
+"""
+Microbenchmarks of the SD-WAN Forwarding feature_detail parsing used by get_flow_detail.
+
+It compares `parse_feature_detail` with find_direction + find_text, and the cached
+`sdwan_forwarding_detail` lookup with the recursive `find_value_path` search. The
+results of both sides are checked to be equal before timing.
+
+Run it from the llm_agent directory:
+
+    python benchmarks/bench_feature_detail.py
+"""
+import pathlib
+import sys
+import timeit
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from flow_detail import (
+    find_direction,
+    find_text,
+    find_value_path,
+    parse_feature_detail,
+    sdwan_forwarding_detail,
+)
+
+NUMBER = 20000
+FIA_FEATURES = 24
+
+SAMPLES = [
+    "SDWAN Forwarding\n  Input  : GigabitEthernet2\n  Output : Tunnel1\n  dir: Upstream\n"
+    "  Local Color: biz-internet\n  Remote Color: mpls\n  Remote System IP: 10.0.0.3\n  Tloc index: 32772",
+    "SDWAN Forwarding\n  Input  : Tunnel2\n  Output : GigabitEthernet3\n  Remote Color : public-internet\n"
+    "  Local Color : private1\n  DIR : downstream\n  Sla Strict: no",
+    "SDWAN Forwarding\n  Input  : GigabitEthernet2\n  Output : GigabitEthernet3\n  Local Service Route",
+]
+
+
+def old_parse(text) -> tuple[str, str, str]:
+    return find_direction(text), find_text(text, "local"), find_text(text, "remote")
+
+
+def old_locate(packet) -> str:
+    sdwan_fwd = find_value_path(packet, "SDWAN Forwarding")
+    return packet[sdwan_fwd[0]][sdwan_fwd[1]]["feature_detail"]
+
+
+def synthetic_packet() -> dict:
+    ingress = [
+        {
+            "feature_name": "Feature %s" % index,
+            "feature_type": "input",
+            "feature_detail": "step %s" % index,
+            "feature_data": {"counters": {"in": index, "out": index}, "flags": ["a", "b"]},
+        }
+        for index in range(FIA_FEATURES)
+    ]
+    egress = [dict(feature) for feature in ingress]
+    egress[FIA_FEATURES - 2] = {"feature_name": "SDWAN Forwarding", "feature_detail": SAMPLES[0]}
+    return {"ingress_fia": ingress, "egress_fia": egress, "packet_size": 1400}
+
+
+def report(name: str, old, new) -> None:
+    old_time = timeit.timeit(old, number=NUMBER)
+    new_time = timeit.timeit(new, number=NUMBER)
+    print("%-28s %10.2f us %10.2f us %7.1fx" % (
+        name, old_time / NUMBER * 1e6, new_time / NUMBER * 1e6, old_time / new_time,
+    ))
+
+
+def main():
+    packet = synthetic_packet()
+    for sample in SAMPLES:
+        assert parse_feature_detail(sample) == old_parse(sample), sample
+    assert sdwan_forwarding_detail(packet) == old_locate(packet)
+
+    print("%-28s %13s %13s %8s" % ("benchmark", "current", "compiled", "speedup"))
+    for index, sample in enumerate(SAMPLES):
+        report("feature_detail sample %s" % index, lambda: old_parse(sample), lambda: parse_feature_detail(sample))
+    report("SDWAN Forwarding lookup", lambda: old_locate(packet), lambda: sdwan_forwarding_detail(packet))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Benchmark of the get_flow_detail hop correlation on large synthetic flowDetail payloads.
+
+It compares `FlowDetailBuilder` with the nested-loop implementation it replaced,
+checks that both produce the same output, and prints the time of each.
+
+Run it from the llm_agent directory:
+
+    python benchmarks/bench_flow_detail.py
+    python benchmarks/bench_flow_detail.py --hops 12 --packets 300
+"""
+import argparse
+import gc
+import pathlib
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from flow_detail import (
+    FlowDetailBuilder,
+    find_direction,
+    find_text,
+    find_value_path,
+    get_feature_detail,
+    get_features_summary,
+    replace_invalid_color,
+)
+from records import HopRecord
+
+SIZES = [(4, 50), (8, 150), (12, 300)]
+# Display keys of the legacy hop dicts, in HopRecord field order
+LEGACY_HOP_KEYS = [
+    "Hop", "Event", "Local Color", "Remote Color", "Ingress Intf", "Egress Intf",
+    "Ingress Features", "Egress Features", "Fwd decision based on",
+]
+FIA_FEATURES = 12
+COLORS = ["biz-internet", "mpls", "public-internet", "INVALID"]
+
+
+def legacy_flow_detail(traces) -> list[dict]:
+    """
+    The nested-loop correlation get_flow_detail used before FlowDetailBuilder, kept as the reference.
+    """
+    flow_detail_summary = []
+    upstream_list = []
+    downstream_list=[]
+    timestamps = []
+    events = []
+    features = []
+    devices = []
+    midpoint = len(traces) // 2
+    for trace in traces[:midpoint]:
+        if "received_timestamp" in trace["data"]:
+            if trace["data"]["received_timestamp"] not in timestamps and trace["data"]["device_name"] not in devices:
+                timestamps.append(trace["data"]["received_timestamp"])
+                devices.append(trace["data"]["device_name"])
+        else:
+            if trace["data"]["packet_received_timestamp"] not in timestamps and trace["data"]["device_name"] not in devices:
+                timestamps.append(trace["data"]["packet_received_timestamp"])
+                devices.append(trace["data"]["device_name"])
+
+    for timestamp in timestamps:
+        for trace in traces:
+            if "received_timestamp" in trace["data"]:
+                if timestamp == trace["data"]["received_timestamp"]:
+                    events.append(trace)
+            if "packet_received_timestamp" in trace["data"]:
+                if timestamp == trace["data"]["packet_received_timestamp"]:
+                    features.append(trace)
+    if len(events) > 0:
+        for event in events[::-1]:
+            for feature in features:
+                if event["data"]["event_direction"] == "upstream" and event["data"]["packet_id"] == feature["data"]["packet"]["packet_id"]:
+                    upstream_list.append({   
+                                    "Hop": event["data"]["device_name"],
+                                    "Event": event["data"]["event_name"],
+                                    "Local Color" : replace_invalid_color(event,"local_color"),
+                                    "Remote Color": replace_invalid_color(event,"remote_color"),
+                                    "Ingress Intf": get_feature_detail(feature,"ingress_fia","Ingress Report"),
+                                    "Egress Intf": get_feature_detail(feature,"egress_fia","Transmit Report"),
+                                    "Ingress Features": get_features_summary(feature, "ingress_fia"),
+                                    "Egress Features": get_features_summary(feature, "egress_fia"),
+                                    "Fwd decision based on": feature["data"]["packet"]["packet_fwd_decision"]
+                                        })
+                    
+                if event["data"]["event_direction"] == "downstream" and event["data"]["packet_id"] == feature["data"]["packet"]["packet_id"]:
+                    downstream_list.append({
+                                    "Hop": event["data"]["device_name"],
+                                    "Event": event["data"]["event_name"],
+                                    "Local Color" : replace_invalid_color(event,"local_color"),
+                                    "Remote Color": replace_invalid_color(event,"remote_color"),
+                                    "Ingress Intf": get_feature_detail(feature,"ingress_fia","Ingress Report"),
+                                    "Egress Intf": get_feature_detail(feature,"egress_fia","Transmit Report"),
+                                    "Ingress Features": get_features_summary(feature, "ingress_fia"),
+                                    "Egress Features": get_features_summary(feature, "egress_fia"),
+                                    "Fwd decision based on": feature["data"]["packet"]["packet_fwd_decision"]
+                                    })
+            
+        flow_detail_summary.append({"Upstream": upstream_list,
+                                "Downstream" : list(reversed(downstream_list))})
+
+    else:
+        for feature in features:
+            sdwan_fwd = find_value_path(feature["data"]["packet"]["packet"], "SDWAN Forwarding")
+            key1 = sdwan_fwd[0]
+            position = sdwan_fwd[1]
+            key2 = "feature_detail"
+            if find_direction(feature["data"]["packet"]["packet"][key1][position][key2]) == "upstream":
+                upstream_list.append({   
+                                "Hop": feature["data"]["device_name"],
+                                "Event": feature["data"]["packet"]["event_name"],
+                                "Local Color" : find_text(feature["data"]["packet"]["packet"][key1][position][key2],"local"),
+                                "Remote Color": find_text(feature["data"]["packet"]["packet"][key1][position][key2],"remote"),
+                                "Ingress Intf": get_feature_detail(feature,"ingress_fia","Ingress Report"),
+                                "Egress Intf": get_feature_detail(feature,"egress_fia","Transmit Report"),
+                                "Ingress Features": get_features_summary(feature, "ingress_fia"),
+                                "Egress Features": get_features_summary(feature, "egress_fia"),
+                                "Fwd decision based on": feature["data"]["packet"]["packet_fwd_decision"]
+                                    })
+                
+            if find_direction(feature["data"]["packet"]["packet"][key1][position][key2]) == "downstream":
+                downstream_list.append({
+                                "Hop": feature["data"]["device_name"],
+                                "Event": feature["data"]["packet"]["event_name"],
+                                "Local Color" : find_text(feature["data"]["packet"]["packet"][key1][position][key2],"local"),
+                                "Remote Color": find_text(feature["data"]["packet"]["packet"][key1][position][key2],"remote"),
+                                "Ingress Intf": get_feature_detail(feature,"ingress_fia","Ingress Report"),
+                                "Egress Intf": get_feature_detail(feature,"egress_fia","Transmit Report"),
+                                "Ingress Features": get_features_summary(feature, "ingress_fia"),
+                                "Egress Features": get_features_summary(feature, "egress_fia"),
+                                "Fwd decision based on": feature["data"]["packet"]["packet_fwd_decision"]
+                                })
+        
+    flow_detail_summary.append({"Upstream": upstream_list,
+                            "Downstream" : list(reversed(downstream_list))})
+
+    return flow_detail_summary
+
+
+def fia_list(hop: int, packet: int, report_name: str, direction: str) -> list[dict]:
+    features = [
+        {"feature_name": "Feature %s" % index, "feature_detail": "hop %s packet %s step %s" % (hop, packet, index)}
+        for index in range(FIA_FEATURES)
+    ]
+    features[FIA_FEATURES // 2] = {
+        "feature_name": "SDWAN Forwarding",
+        "feature_detail": "SDWAN Forwarding dir: %s Local Color: %s Remote Color: %s"
+        % (direction, COLORS[hop % 3], COLORS[(hop + 1) % 3]),
+    }
+    features.append({"feature_name": report_name, "feature_detail": "GigabitEthernet%s" % hop})
+    return features
+
+
+def synthetic_flow_detail(hops: int, packets: int, with_events: bool = True) -> list[dict]:
+    """
+    Build a flowDetail payload with one event and one feature record per hop and packet.
+    """
+    traces = []
+    for packet in range(packets):
+        for hop in range(hops):
+            direction = "Upstream" if hop < hops // 2 else "Downstream"
+            timestamp = 1720000000000 + hop
+            if with_events:
+                traces.append({
+                    "type": "event-of-packet",
+                    "data": {
+                        "received_timestamp": timestamp,
+                        "device_name": "edge-%s" % hop,
+                        "event_direction": direction.lower(),
+                        "packet_id": packet,
+                        "event_name": "WAN_DROP" if packet % 7 == 0 else "NONE",
+                        "local_color": COLORS[(hop + packet) % 4],
+                        "remote_color": COLORS[(hop + packet) % 4],
+                    },
+                })
+            traces.append({
+                "type": "feature-of-packet",
+                "data": {
+                    "packet_received_timestamp": timestamp,
+                    "device_name": "edge-%s" % hop,
+                    "packet": {
+                        "packet_id": packet,
+                        "event_name": "NONE",
+                        "packet_fwd_decision": "SDWAN_ROUTE",
+                        "packet": {
+                            "ingress_fia": fia_list(hop, packet, "Ingress Report", direction),
+                            "egress_fia": fia_list(hop, packet, "Transmit Report", direction),
+                        },
+                    },
+                },
+            })
+    return traces
+
+
+def builder_flow_detail(traces: list[dict]) -> list[dict]:
+    builder = FlowDetailBuilder()
+    for trace in traces:
+        builder.add(trace)
+    return builder.result()
+
+
+def as_legacy(result: list[dict]) -> list[dict]:
+    """
+    Convert the HopRecord lists of a builder result to the legacy display dicts.
+    """
+    return [
+        {
+            direction: [dict(zip(LEGACY_HOP_KEYS, (getattr(hop, f) for f in HopRecord.__slots__))) for hop in hops]
+            for direction, hops in summary.items()
+        }
+        for summary in result
+    ]
+
+
+def timed(function, traces: list[dict]) -> tuple[float, list[dict]]:
+    gc.collect()
+    start = time.perf_counter()
+    result = function(traces)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--hops", type=int, help="Number of hops of a single run")
+    parser.add_argument("--packets", type=int, help="Number of packets of a single run")
+    args = parser.parse_args()
+    sizes = [(args.hops, args.packets)] if args.hops and args.packets else SIZES
+
+    print("%-8s %6s %8s %8s %12s %12s %8s" % ("events", "hops", "packets", "records", "legacy (s)", "builder (s)", "speedup"))
+    for with_events in (True, False):
+        for hops, packets in sizes:
+            traces = synthetic_flow_detail(hops, packets, with_events)
+            legacy_time, legacy_result = timed(legacy_flow_detail, traces)
+            builder_time, builder_result = timed(builder_flow_detail, traces)
+            assert as_legacy(builder_result) == legacy_result, "FlowDetailBuilder output differs from the legacy output"
+            print("%-8s %6s %8s %8s %12.4f %12.4f %7.1fx" % (
+                with_events, hops, packets, len(traces), legacy_time, builder_time, legacy_time / builder_time,
+            ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+This module turns the LangGraph event stream of a chat into Server-Sent Events.
+
+The events tell the client what the graph is doing while it runs: which worker the
+supervisor picked, which worker started, which tools run, the answer tokens as the
+model writes them, and each worker's answer. The last event is "final", with the
+answer that /chat would return, or "error" when the run failed, after a
+"budget" event with the usage of the request when it has a budget. Event
+payloads are JSON.
+"""
+import json
+import logging
+
+from request_budget import budget_of, budget_stats
+
+logger = logging.getLogger(__name__)
+
+WORKER_NODES = {"Tracer", "Reviewer"}
+SUPERVISOR_NODE = "supervisor"
+
+
+def sse(event: str, data: dict) -> str:
+    return "event: %s\ndata: %s\n\n" % (event, json.dumps(data, default=str))
+
+
+def _last_content(output) -> str:
+    if isinstance(output, dict) and output.get("input"):
+        return output["input"][-1].content
+    return ""
+
+
+async def stream_chat_events(graph, inputs: dict, config: dict = None):
+    """
+    Run the graph and yield its progress as SSE messages.
+
+    :param graph: Compiled agent graph.
+    :param inputs: Graph input, as given to ainvoke.
+    :return: Async generator of "event: ...\\ndata: ...\\n\\n" strings.
+    """
+    final = ""
+    error = None
+    try:
+        async for event in graph.astream_events(inputs, config=config, version="v2"):
+            kind = event["event"]
+            name = event["name"]
+            node = event.get("metadata", {}).get("langgraph_node")
+            # Only the node runnables themselves, not the chains nested in them
+            is_node = node == name
+            if kind == "on_chain_start" and is_node and name in WORKER_NODES:
+                yield sse("node_start", {"node": name})
+            elif kind == "on_chain_end" and is_node and name in WORKER_NODES:
+                content = _last_content(event["data"].get("output"))
+                final = content or final
+                yield sse("message", {"node": name, "content": content})
+            elif kind == "on_chain_end" and is_node and name == SUPERVISOR_NODE:
+                output = event["data"].get("output") or {}
+                # The supervisor only answers when the request budget ran out before any worker did
+                final = _last_content(output) or final
+                yield sse("route", {"next": output.get("next")})
+            elif kind == "on_tool_start":
+                yield sse("tool_start", {"node": node, "tool": name})
+            elif kind == "on_tool_end":
+                yield sse("tool_end", {"node": node, "tool": name})
+            elif kind == "on_chat_model_stream":
+                delta = event["data"]["chunk"].content
+                # Supervisor routes and tool calls stream function arguments, not text
+                if delta:
+                    yield sse("token", {"node": node, "delta": delta})
+    except Exception as e:
+        logger.exception("CHAT_STREAM_FAILED")
+        error = str(e)
+    budget = budget_of(config)
+    if budget is not None:
+        yield sse("budget", budget_stats.record(budget))
+    # A failed run has no answer, the partial one would read as complete
+    if error is not None:
+        yield sse("error", {"message": error})
+    else:
+        yield sse("final", {"content": final})
@@ -0,0 +1,147 @@
+"""
+This module keeps the checkpoints of the agent graph in a local SQLite file, keyed by thread id.
+
+The graph saves its state after every completed node, so a run survives a
+timed-out request or a restart of the app. A thread holds one run at a time:
+the checkpoints of a finished run are deleted, the conversation itself is
+remembered by session_memory. When the next message of a thread finds an
+unfinished run, that run is resumed from its last completed node first and its
+answer is returned as such, then the new message is processed. The requests of
+a thread hold its `thread_lock`, so a run still in flight is never taken for an
+interrupted one. A resumed run that fails again is dropped. Threads left
+unfinished and never resumed are pruned after CHECKPOINT_TTL seconds.
+`CHECKPOINT_PATH` sets the file (default checkpoints.db next to this module).
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+import weakref
+from typing import Optional
+
+import aiosqlite
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_PATH = os.getenv(
+    "CHECKPOINT_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "checkpoints.db")
+)
+CHECKPOINT_TTL = int(os.getenv("CHECKPOINT_TTL", "86400"))
+PRUNE_INTERVAL = 3600
+CHECKPOINT_TABLES = ("checkpoints", "writes", "thread_activity")
+ACTIVITY_SCHEMA = "CREATE TABLE IF NOT EXISTS thread_activity (thread_id TEXT PRIMARY KEY, updated REAL NOT NULL)"
+
+_last_prune = 0.0
+# thread_id -> lock of the request running in the thread, gone once no request holds it
+_thread_locks = weakref.WeakValueDictionary()
+
+
+def open_checkpointer(path: str = CHECKPOINT_PATH) -> AsyncSqliteSaver:
+    """
+    Create the checkpointer. It must be created in the event loop that runs the graph, the file is opened on first use.
+    """
+    return AsyncSqliteSaver(aiosqlite.connect(path))
+
+
+def thread_config(thread_id: Optional[str], session_id: Optional[str] = None) -> dict:
+    """
+    Build the graph config of a message, a message without a thread gets a new one, also used as its session.
+    """
+    thread_id = thread_id or uuid.uuid4().hex
+    return {"configurable": {"thread_id": thread_id, "session_id": session_id or thread_id}}
+
+
+def thread_lock(config: dict) -> asyncio.Lock:
+    """
+    Get the lock that serializes the requests of a thread, held from the resume to the end of the run.
+    """
+    thread_id = config["configurable"]["thread_id"]
+    lock = _thread_locks.get(thread_id)
+    if lock is None:
+        lock = _thread_locks[thread_id] = asyncio.Lock()
+    return lock
+
+
+async def _execute(checkpointer: AsyncSqliteSaver, statements: list) -> None:
+    await checkpointer.setup()
+    async with checkpointer.lock:
+        await checkpointer.conn.execute(ACTIVITY_SCHEMA)
+        for statement, params in statements:
+            await checkpointer.conn.execute(statement, params)
+        await checkpointer.conn.commit()
+
+
+async def resume_pending(graph, config: dict) -> Optional[str]:
+    """
+    Finish the unfinished run of the thread, if there is one. The caller holds the thread_lock.
+
+    :return: The answer of the resumed run, or None when the thread had no unfinished run or it failed again.
+    """
+    if graph.checkpointer is None:
+        return None
+    snapshot = await graph.aget_state(config)
+    if not snapshot.next:
+        return None
+    thread_id = config["configurable"]["thread_id"]
+    logger.info("THREAD_RESUMED: %s at %s", thread_id, snapshot.next)
+    try:
+        result = await graph.ainvoke(None, config=config)
+    except Exception:
+        # A run that fails again is dropped, it would fail every next message of the thread until it expires
+        logger.exception("THREAD_RESUME_FAILED: %s", thread_id)
+        await close_run(graph, config, resumable=False)
+        return None
+    await close_run(graph, config)
+    return result["input"][-1].content
+
+
+async def start_run(graph, config: dict) -> None:
+    """
+    Mark the thread as active, for the pruning of abandoned threads.
+    """
+    if graph.checkpointer is None:
+        return
+    await _execute(
+        graph.checkpointer,
+        [("INSERT OR REPLACE INTO thread_activity VALUES (?, ?)", (config["configurable"]["thread_id"], time.time()))],
+    )
+
+
+async def close_run(graph, config: dict, resumable: bool = True) -> None:
+    """
+    Delete the checkpoints of a run once it finished, or when nothing can resume it. An interrupted run is kept.
+    """
+    if graph.checkpointer is None:
+        return
+    snapshot = await graph.aget_state(config)
+    if not snapshot.next or not resumable:
+        await delete_thread(graph.checkpointer, config["configurable"]["thread_id"])
+    if time.monotonic() - _last_prune >= PRUNE_INTERVAL:
+        await prune_threads(graph.checkpointer)
+
+
+async def delete_thread(checkpointer: AsyncSqliteSaver, thread_id: str) -> None:
+    """
+    Delete the checkpoints of a thread.
+    """
+    await _execute(
+        checkpointer,
+        [("DELETE FROM %s WHERE thread_id = ?" % table, (thread_id,)) for table in CHECKPOINT_TABLES],
+    )
+
+
+async def prune_threads(checkpointer: AsyncSqliteSaver, ttl: int = CHECKPOINT_TTL) -> None:
+    """
+    Delete the threads left unfinished for longer than ttl seconds.
+    """
+    global _last_prune
+    _last_prune = time.monotonic()
+    stale = "SELECT thread_id FROM thread_activity WHERE updated < ?"
+    expiry = (time.time() - ttl,)
+    await _execute(
+        checkpointer,
+        [("DELETE FROM %s WHERE thread_id IN (%s)" % (table, stale), expiry) for table in CHECKPOINT_TABLES[:-1]]
+        + [("DELETE FROM thread_activity WHERE updated < ?", expiry)],
+    )
@@ -0,0 +1,172 @@
+"""
+This module provides an in-memory inventory of the vManage devices indexed by site-id and system-ip.
+
+The inventory downloads `health/devices` once for every site instead of once per
+site lookup, and parses each software version into a comparable tuple when the
+device is indexed. A background thread keeps it fresh: the request goes through
+the response cache, so an unchanged device list is revalidated with its ETag and
+the indexes are only rebuilt when vManage sends a new body.
+"""
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+DEVICES_API = "/health/devices?page_size=12000"
+REFRESH_INTERVAL = 60
+VERSION_NUMBERS = re.compile(r"\d+")
+
+
+def parse_version(version: str) -> tuple:
+    """
+    Parse a software version into a tuple of integers, e.g. "17.09.04a" -> (17, 9, 4).
+    """
+    return tuple(int(number) for number in VERSION_NUMBERS.findall(version or ""))
+
+
+@dataclass(slots=True)
+class InventoryDevice:
+    """
+    One device of the inventory with its pre-parsed version.
+    """
+
+    system_ip: str
+    uuid: str
+    site_id: str
+    version: str
+    version_tuple: tuple
+    reachable: bool
+
+    @classmethod
+    def from_health(cls, device: dict) -> "InventoryDevice":
+        version = device.get("software_version", "")
+        return cls(
+            device.get("system_ip"),
+            device.get("uuid"),
+            str(device.get("site_id", device.get("site-id", ""))),
+            version,
+            parse_version(version),
+            device.get("reachability") == "reachable",
+        )
+
+    def trace_device(self) -> dict:
+        """
+        Get the device entry of a start_trace device list.
+        """
+        return {
+            "local-system-ip": self.system_ip,
+            "deviceId": self.system_ip,
+            "uuid": self.uuid,
+            "version": self.version,
+        }
+
+
+class DeviceInventory:
+    """
+    This class keeps the device list of vManage indexed in memory and refreshes it in the background.
+    """
+
+    def __init__(self, client, async_client=None, refresh_interval: int = REFRESH_INTERVAL):
+        self.client = client
+        self.async_client = async_client
+        self.refresh_interval = refresh_interval
+        self._by_site = {}
+        self._by_ip = {}
+        self._body = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _index(self, response) -> None:
+        if response.status_code != 200:
+            print("Error:", response.status_code)
+            return
+        # A revalidated cache entry carries the same body, nothing to re-index
+        if response.content == self._body:
+            self._loaded_at = time.monotonic()
+            return
+        by_site = {}
+        by_ip = {}
+        for item in response.json().get("devices", []):
+            device = InventoryDevice.from_health(item)
+            by_site.setdefault(device.site_id, []).append(device)
+            by_ip[device.system_ip] = device
+        with self._lock:
+            self._by_site = by_site
+            self._by_ip = by_ip
+            self._body = response.content
+            self._loaded_at = time.monotonic()
+        logger.info("DEVICE_INVENTORY_INDEXED: %s devices in %s sites", len(by_ip), len(by_site))
+
+    def _is_stale(self) -> bool:
+        return time.monotonic() - self._loaded_at >= self.refresh_interval
+
+    def refresh(self) -> None:
+        self._index(self.client.get(DEVICES_API))
+
+    async def arefresh(self) -> None:
+        self._index(await self.async_client.get(DEVICES_API))
+
+    def _refresh_failed(self, error: Exception) -> None:
+        # A stale inventory still answers, a lookup only fails when there is none yet
+        logger.warning("DEVICE_INVENTORY_REFRESH_FAILED: %s", error)
+        if self._body is None:
+            raise error
+
+    def devices_at_site(self, site) -> list[InventoryDevice]:
+        """
+        Get the reachable devices of a site, loading the inventory first if it is stale.
+        When the reload fails the previous inventory answers.
+        """
+        if self._is_stale():
+            try:
+                self.refresh()
+            except Exception as e:
+                self._refresh_failed(e)
+        return [device for device in self._by_site.get(str(site), ()) if device.reachable]
+
+    async def adevices_at_site(self, site) -> list[InventoryDevice]:
+        if self._is_stale():
+            try:
+                await self.arefresh()
+            except Exception as e:
+                self._refresh_failed(e)
+        return [device for device in self._by_site.get(str(site), ()) if device.reachable]
+
+    def device(self, system_ip: str) -> Optional[InventoryDevice]:
+        return self._by_ip.get(system_ip)
+
+    def version_of(self, device: dict) -> tuple[tuple, str]:
+        """
+        Get the parsed and the raw version of a start_trace device entry, from the inventory when it knows the device.
+        """
+        known = self._by_ip.get(device.get("local-system-ip", device.get("deviceId")))
+        if known is not None and known.version == device.get("version", known.version):
+            return known.version_tuple, known.version
+        return parse_version(device["version"]), device["version"]
+
+    def start(self) -> None:
+        """
+        Start refreshing the inventory every refresh_interval seconds in a daemon thread.
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="device-inventory", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                # A failed refresh keeps the previous indexes, the next one tries again
+                logger.warning("DEVICE_INVENTORY_REFRESH_FAILED: %s", e)
+            self._stop.wait(self.refresh_interval)
@@ -2,15 +2,19 @@
 This module contains Pydantic models for handling webhook messages in a FastAPI application.
 """
 
+from typing import Optional
+
 from pydantic import BaseModel
 
 
 class Message(BaseModel):
     """
     This class represents a message model.
+    The session_id scopes the conversation memory, a message without one has no history.
     """
 
     message: str
+    session_id: Optional[str] = None
 
 class AlertAnnotations(BaseModel):
     """
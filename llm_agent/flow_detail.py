@@ -0,0 +1,318 @@
+"""
+This module correlates NWPI flowDetail records into the upstream and downstream hop lists
+returned by the get_flow_detail tool.
+
+`FlowDetailBuilder` receives the records one at a time, indexes events and features by
+timestamp and features by packet_id, and joins them with dictionary lookups instead of
+nested scans over the whole response. SD-WAN Forwarding feature details are read with
+one precompiled pattern, and the entry is located through a per-schema cache.
+"""
+import re
+
+from records import HopRecord
+
+
+def find_direction(text) -> str:
+    # Compile regular expressions to search for 'dir:Upstream' or 'dir:Downstream'
+    upstream = re.compile(r'dir\s*:\s*Upstream', re.IGNORECASE)
+    downstream = re.compile(r'dir\s*:\s*Downstream', re.IGNORECASE)
+
+
+    if upstream.search(text):
+        return "upstream"
+
+    if downstream.search(text):
+        return "downstream"
+            
+    # Return 'not found' if neither pattern is present
+    return "not found"
+
+def find_text(text, pattern) -> str:
+    # Compile regular expressions to search for 'dir:Upstream' or 'dir:Downstream'
+    local_color = re.compile(r'Local\s+Color\s*:\s*([\w-]+)', re.IGNORECASE)
+    remote_color = re.compile(r'Remote\s+Color\s*:\s*([\w-]+)', re.IGNORECASE)
+            
+    if pattern == "local":
+        match = local_color.search(text)
+        if match:
+            return match.group(1)
+    
+    if pattern == "remote":
+        match = remote_color.search(text)
+        if match:
+            return match.group(1)
+    
+    # Return 'not found' if neither pattern is present
+    return "not found"
+
+def find_value_path(data, target):
+    """
+    Recursively find the path to the target value in a nested dictionary or list.
+
+    Parameters:
+    - data (dict or list): The nested data structure to search.
+    - target: The value to find.
+
+    Returns:
+    - list: A list of keys and indices representing the path to the target value.
+    """
+
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if isinstance(value, list) or isinstance(value, dict):
+                # Recursively search for the target in nested structures
+                path = find_value_path(value, target)
+                if path is not None:
+                    return [key] + path
+            elif value == target:
+                return [key]
+    elif isinstance(data, list):
+        for index, item in enumerate(data):
+            if isinstance(item, dict) or isinstance(item, list):
+                # Recursively search for the target in nested structures
+                path = find_value_path(item, target)
+                if path is not None:
+                    return [index] + path
+            elif item == target:
+                return [index]
+    return None
+
+
+def get_feature_detail(json_data, direction, feature_name):
+    if json_data["type"] == "feature-of-packet":
+        for feature in json_data["data"]["packet"]['packet'][direction]:
+            if feature['feature_name'] == feature_name:
+                return feature['feature_detail']
+    return
+
+def get_features_summary(json_data, direction):
+    if json_data["type"] == "feature-of-packet":
+        features = []
+        for feature in json_data["data"]["packet"]['packet'][direction]:
+            features.append(feature["feature_name"])
+        return features
+    return
+
+def replace_invalid_color(event, color_side):
+    if event["data"]["event_direction"] == "upstream" and event["data"]["local_color"] == "INVALID" and event["data"]["remote_color"] == "INVALID":
+        if color_side == "local_color":
+            return "Service LAN"
+        if color_side  == "remote_color":
+            return "N/A"
+    if event["data"]["event_direction"] == "downstream" and event["data"]["local_color"] == "INVALID" and event["data"]["remote_color"] == "INVALID":
+        if color_side == "local_color":
+            return "N/A"
+        if color_side  == "remote_color":
+            return "Service LAN"
+    return event["data"][color_side]
+
+
+def summarize_fia(feature, direction, report_name):
+    """
+    Get the report detail and the feature names of one FIA list in a single pass.
+
+    Parameters:
+    - feature (dict): A "feature-of-packet" flowDetail record.
+    - direction (str): "ingress_fia" or "egress_fia".
+    - report_name (str): Feature whose detail is reported as the interface, e.g. "Ingress Report".
+
+    Returns:
+    - tuple: The report feature_detail and the list of feature names, (None, None) for other record types.
+    """
+    if feature["type"] != "feature-of-packet":
+        return None, None
+    detail = None
+    found = False
+    names = []
+    for item in feature["data"]["packet"]["packet"][direction]:
+        names.append(item["feature_name"])
+        if not found and item["feature_name"] == report_name:
+            detail = item["feature_detail"]
+            found = True
+    return detail, names
+
+
+# One pattern for direction and colors, so a feature_detail text is scanned once
+FEATURE_DETAIL_PATTERN = re.compile(
+    r'dir\s*:\s*(?P<direction>Upstream|Downstream)'
+    r'|Local\s+Color\s*:\s*(?P<local>[\w-]+)'
+    r'|Remote\s+Color\s*:\s*(?P<remote>[\w-]+)',
+    re.IGNORECASE,
+)
+
+MAX_PACKET_SCHEMAS = 1024
+
+# packet schema -> (FIA key, position) of the "SDWAN Forwarding" entry
+_sdwan_forwarding_locations = {}
+
+
+def parse_feature_detail(text) -> tuple[str, str, str]:
+    """
+    Get direction, local color and remote color of an SD-WAN Forwarding feature_detail in one pass.
+
+    Returns the same values as find_direction(text), find_text(text, "local") and
+    find_text(text, "remote"), "not found" for anything missing.
+    """
+    direction = "not found"
+    local_color = None
+    remote_color = None
+    for match in FEATURE_DETAIL_PATTERN.finditer(text):
+        group = match.lastgroup
+        if group == "direction":
+            # Upstream wins wherever it appears, like in find_direction
+            if match.group("direction").lower() == "upstream":
+                direction = "upstream"
+            elif direction == "not found":
+                direction = "downstream"
+        elif group == "local" and local_color is None:
+            local_color = match.group("local")
+        elif group == "remote" and remote_color is None:
+            remote_color = match.group("remote")
+        if direction == "upstream" and local_color is not None and remote_color is not None:
+            break
+    return direction, local_color or "not found", remote_color or "not found"
+
+
+def packet_schema(packet: dict) -> tuple:
+    """
+    Get the shape of a packet: its keys, with the length of the FIA lists.
+    """
+    return tuple((key, len(value)) if isinstance(value, list) else key for key, value in packet.items())
+
+
+def sdwan_forwarding_detail(packet: dict):
+    """
+    Get the feature_detail of the "SDWAN Forwarding" entry of a packet, None if the packet has none.
+
+    The entry location is cached per packet schema, so packets shaped like one seen
+    before are answered with a single lookup instead of a recursive search.
+    """
+    schema = packet_schema(packet)
+    location = _sdwan_forwarding_locations.get(schema)
+    if location is not None:
+        entry = packet[location[0]][location[1]]
+        if isinstance(entry, dict) and entry.get("feature_name") == "SDWAN Forwarding":
+            return entry["feature_detail"]
+
+    sdwan_fwd = find_value_path(packet, "SDWAN Forwarding")
+    if sdwan_fwd is None:
+        return None
+    if len(_sdwan_forwarding_locations) >= MAX_PACKET_SCHEMAS:
+        _sdwan_forwarding_locations.clear()
+    _sdwan_forwarding_locations[schema] = (sdwan_fwd[0], sdwan_fwd[1])
+    return packet[sdwan_fwd[0]][sdwan_fwd[1]]["feature_detail"]
+
+
+class FlowDetailBuilder:
+    """
+    This class builds the get_flow_detail hop lists from flowDetail records added one by one.
+
+    Each record is reduced to the few fields the hop lists need as soon as it is added,
+    so the builder can be fed from a streaming parser without keeping the packet trees.
+    """
+
+    def __init__(self):
+        # (timestamp, device_name) of every record, used to pick one timestamp per hop
+        self._keys = []
+        # timestamp -> [(device_name, event_name, direction, packet_id, local_color, remote_color)]
+        self._events = {}
+        # timestamp -> [(packet_id, device_name, event_name, columns, sdwan_forwarding_detail)]
+        self._features = {}
+
+    def add(self, trace: dict) -> None:
+        data = trace["data"]
+        if "received_timestamp" in data:
+            self._keys.append((data["received_timestamp"], data.get("device_name")))
+            self._events.setdefault(data["received_timestamp"], []).append(self._compact_event(trace))
+        else:
+            self._keys.append((data["packet_received_timestamp"], data.get("device_name")))
+        if "packet_received_timestamp" in data:
+            self._features.setdefault(data["packet_received_timestamp"], []).append(self._compact_feature(trace))
+
+    @staticmethod
+    def _compact_event(event) -> tuple:
+        data = event["data"]
+        direction = data.get("event_direction")
+        if direction in ("upstream", "downstream"):
+            local_color = replace_invalid_color(event, "local_color")
+            remote_color = replace_invalid_color(event, "remote_color")
+        else:
+            local_color = remote_color = None
+        return (data.get("device_name"), data.get("event_name"), direction, data.get("packet_id"),
+                local_color, remote_color)
+
+    @staticmethod
+    def _compact_feature(feature) -> tuple:
+        packet = feature["data"]["packet"]
+        ingress_intf, ingress_features = summarize_fia(feature, "ingress_fia", "Ingress Report")
+        egress_intf, egress_features = summarize_fia(feature, "egress_fia", "Transmit Report")
+        columns = (ingress_intf, egress_intf, ingress_features, egress_features, packet["packet_fwd_decision"])
+        return (packet["packet_id"], feature["data"].get("device_name"), packet.get("event_name"), columns,
+                sdwan_forwarding_detail(packet["packet"]))
+
+    def _hop_timestamps(self) -> list:
+        """
+        Get one timestamp per device, taken from the first half of the records as vManage orders them.
+        """
+        timestamps = []
+        seen_timestamps = set()
+        seen_devices = set()
+        for timestamp, device in self._keys[:len(self._keys) // 2]:
+            if timestamp not in seen_timestamps and device not in seen_devices:
+                timestamps.append(timestamp)
+                seen_timestamps.add(timestamp)
+                seen_devices.add(device)
+        return timestamps
+
+    @staticmethod
+    def _hop(hop, event_name, local_color, remote_color, columns) -> HopRecord:
+        return HopRecord(hop, event_name, local_color, remote_color, *columns)
+
+    def result(self) -> list[dict]:
+        """
+        Join events and features of the selected timestamps into hop lists.
+
+        Returns:
+        - list[dict]: The {"Upstream": [HopRecord], "Downstream": [HopRecord]} summary of the flow.
+        """
+        timestamps = self._hop_timestamps()
+        events = [event for timestamp in timestamps for event in self._events.get(timestamp, ())]
+        features = [feature for timestamp in timestamps for feature in self._features.get(timestamp, ())]
+
+        flow_detail_summary = []
+        upstream_list = []
+        downstream_list = []
+        if len(events) > 0:
+            features_by_packet = {}
+            for feature in features:
+                features_by_packet.setdefault(feature[0], []).append(feature)
+
+            for device_name, event_name, direction, packet_id, local_color, remote_color in events[::-1]:
+                if direction == "upstream":
+                    hop_list = upstream_list
+                elif direction == "downstream":
+                    hop_list = downstream_list
+                else:
+                    continue
+                for feature in features_by_packet.get(packet_id, ()):
+                    hop_list.append(self._hop(device_name, event_name, local_color, remote_color, feature[3]))
+
+            # The event path has always reported the hop lists twice; callers rely on the last entry.
+            flow_detail_summary.append({"Upstream": upstream_list,
+                                        "Downstream": list(reversed(downstream_list))})
+        else:
+            for _, device_name, event_name, columns, feature_detail in features:
+                if feature_detail is None:
+                    continue
+                direction, local_color, remote_color = parse_feature_detail(feature_detail)
+                if direction == "upstream":
+                    hop_list = upstream_list
+                elif direction == "downstream":
+                    hop_list = downstream_list
+                else:
+                    continue
+                hop_list.append(self._hop(device_name, event_name, local_color, remote_color, columns))
+
+        flow_detail_summary.append({"Upstream": upstream_list,
+                                    "Downstream": list(reversed(downstream_list))})
+        return flow_detail_summary
@@ -6,24 +6,30 @@ from langchain.agents import AgentExecutor, create_openai_tools_agent
 from langchain_core.messages import AnyMessage, BaseMessage, HumanMessage
 from typing import Annotated, TypedDict
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.tools.render import format_tool_to_openai_function
-from langchain.agents.output_parsers import OpenAIFunctionsAgentOutputParser
-from langchain.agents.format_scratchpad import (
-    format_to_openai_function_messages,
+from langchain.agents.output_parsers.openai_tools import OpenAIToolsAgentOutputParser
+from langchain.agents.format_scratchpad.openai_tools import (
+    format_to_openai_tool_messages,
 )
 
 from llm_tools_list import reviewer_tools, nwpi_tools
+from tool_budget import bound_scratchpad, budget_tools
+from tool_executor import ParallelToolExecutor
+from tool_schemas import tool_schemas
+from supervisor_routing import create_supervisor_node
+from llm_cache import DEFAULT_TTL, llm_cache, llm_cache_scope
+from session_memory import DEFAULT_SESSION, session_memory
+from request_budget import BudgetExceeded, budget_of
 from logging_config.main import setup_logging
 from utils.text_utils import remove_white_spaces
 from langchain_core.output_parsers.openai_functions import JsonOutputFunctionsParser
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import END, StateGraph, START
 from typing import Sequence, TypedDict
-from langchain.memory import ConversationBufferMemory
 from typing import Annotated
+import argparse
 import operator
 import functools
-from IPython.display import Image, display
 
 logger = setup_logging()
 
@@ -51,22 +57,31 @@ You are a Cisco SD-WAN expert AI assistant, your role is to start Network Wide P
 2.Use the 'get_site_list' function to obtain the list of available sites to run the trace and confirm it matches with the user input.
 3.Before starting the trace, use the 'get_device_details_from_site' to retrieve the device list that will be used as parameter.
 4.Use the VPN, site id and source and destination networks provided by the user as parameters to start the trace.
-5.After starting a trace, use the tracer_wait tool before checking if there are any flows captured. 
+5.After starting a trace, use the tracer_wait tool with the trace_id and start_time before checking if there are any flows captured. It returns as soon as flows are available. 
 6.Verify if there are any flows and if there is any reported event. Use the trace_readout and get_flow_summary tools.
 7.Get the "device_trace_id" with "get_device_trace_id" if it doesn't match the "trace_id" use it, otherwise use the "trace_id" value. 
 7.Provide details of a flow that corresponds to what the user is asking for, use the get_flow_detail tool.
-8.If the flow_detail is empty, try using a different flow id.
+8.When several flows could match, or if the flow_detail is empty, use get_flow_details with all the candidate flows in one call.
 9.When user request information of a trace, always use "get_entry_time_and_state" to retrieve the entry_time and state, use it to get other information.
 10.Even If the trace is already stopped, you can still provide information to the user about the captured summary flows.
 11.If the state indicates an issue, you should still try to provide the user with the information requested.
 12.To present the flow summary use one row for each flow.
 13.Must use as much as possible emojis that are relevant to your messages to make them more human-friendly.
+14.When the user asks about several sites, use start_multi_site_trace once for all of them, then multi_site_trace_readout and get_multi_site_flow_summary with its handle. Use tracer_wait with the trace_id and timestamp of one of the sites before reading the results.
+15.If a tool result is truncated, its summary tells what it contains. Use get_next_page with the cursor and page of "next_page" only when the rest is needed.
+16.Call tools that do not depend on each other in the same turn, e.g. get_site_list with get_device_details_from_site, or trace_readout with get_flow_summary.
 """
 
+# Prompts are compacted once at import, not every time an agent is built
+TRACER_SYSTEM_PROMPT = remove_white_spaces(TRACER_PROMPT)
+REVIEWER_SYSTEM_PROMPT = remove_white_spaces(REVIEWER_PROMPT)
+
 MEMORY_KEY = "chat_history"
 
-def create_agent(llm: ChatOpenAI, tools: list, system_prompt: str):
+def create_agent(llm: ChatOpenAI, tools: list, system_prompt: str, tool_budgets: dict = None):
     # Each worker node will be given a name and some tools.
+    # Results over their token budget are paged, the agent gets get_next_page for the rest.
+    tools = budget_tools(tools, tool_budgets)
     prompt = ChatPromptTemplate.from_messages(
         [
             (
@@ -79,36 +94,80 @@ def create_agent(llm: ChatOpenAI, tools: list, system_prompt: str):
         ]
     )
     # agent = create_openai_tools_agent(llm, tools, prompt)
-    llm_with_tools = llm.bind(
-        functions=[format_tool_to_openai_function(t) for t in tools]
-    )
+    # The model can call several independent tools in one turn.
+    # The schemas come precomputed from tool_schemas, converting them is slow.
+    llm_with_tools = llm.bind_tools(tool_schemas.schemas(tools), parallel_tool_calls=True)
     agent = (
         {
             "input": lambda x: x["input"],
-            "agent_scratchpad": lambda x: format_to_openai_function_messages(
+            "agent_scratchpad": lambda x: bound_scratchpad(format_to_openai_tool_messages(
                 x.get("intermediate_steps",[])
-            ),
+            )),
             "chat_history": lambda x: x.get("chat_history",[]),
         }
         | prompt
         | llm_with_tools
-        | OpenAIFunctionsAgentOutputParser()
+        | OpenAIToolsAgentOutputParser()
     )
-    memory = ConversationBufferMemory(
-            memory_key="chat_history", return_messages=True
-        )
-    
-    executor = AgentExecutor(agent=agent, tools=tools, memory=memory)
+    # The chat history is not kept by the executor, agent_node passes the one of the session.
+    # The tool calls of a turn run concurrently on a bounded pool.
+    executor = ParallelToolExecutor(agent=agent, tools=tools)
     return executor
 
-def agent_node(state, agent, name):
-    result = agent.invoke({"input": state["input"][-1].content})
-    output_message = result["output"]  # Extract the output message
-    
+def session_id_of(config) -> str:
+    return (config or {}).get("configurable", {}).get("session_id") or DEFAULT_SESSION
+
+def agent_node(state, config, agent, name, cache_ttl=DEFAULT_TTL):
+    session_id = session_id_of(config)
+    user_input = state["input"][-1].content
+    try:
+        with llm_cache_scope(cache_ttl):
+            result = agent.invoke({
+                "input": user_input,
+                MEMORY_KEY: session_memory.history(session_id, name),
+            })
+    except BudgetExceeded as e:
+        # The request is out of budget, answer with what the worker gathered so far
+        output_message = budget_of(config).partial_answer(e.reason)
+    else:
+        output_message = result["output"]  # Extract the output message
+        session_memory.append(session_id, name, user_input, output_message)
+
+    # Only the new message, the operator.add reducer appends it to the state
+    return {
+        "input": [HumanMessage(content=output_message, name=name)],
+    }
+
+async def aagent_node(state, config, agent, name, cache_ttl=DEFAULT_TTL):
+    session_id = session_id_of(config)
+    user_input = state["input"][-1].content
+    try:
+        with llm_cache_scope(cache_ttl):
+            result = await agent.ainvoke({
+                "input": user_input,
+                MEMORY_KEY: session_memory.history(session_id, name),
+            })
+    except BudgetExceeded as e:
+        # The request is out of budget, answer with what the worker gathered so far
+        output_message = budget_of(config).partial_answer(e.reason)
+    else:
+        output_message = result["output"]  # Extract the output message
+        session_memory.append(session_id, name, user_input, output_message)
+
+    # Only the new message, the operator.add reducer appends it to the state
     return {
-        "input": state["input"] + [HumanMessage(content=output_message, name=name)],
+        "input": [HumanMessage(content=output_message, name=name)],
     }
 
+def create_agent_node(agent, name, cache_ttl=DEFAULT_TTL) -> RunnableLambda:
+    # The node runs the executor with invoke() under graph.invoke and with
+    # ainvoke() under graph.ainvoke, so async tools never block a thread.
+    # cache_ttl=None keeps the LLM calls of the node out of the LLM cache.
+    return RunnableLambda(
+        functools.partial(agent_node, agent=agent, name=name, cache_ttl=cache_ttl),
+        afunc=functools.partial(aagent_node, agent=agent, name=name, cache_ttl=cache_ttl),
+    )
+
 members = ["Tracer", "Reviewer"]
 system_prompt = (
     "You are a supervisor tasked with managing a conversation between the"
@@ -150,7 +209,9 @@ prompt = ChatPromptTemplate.from_messages(
     ]
 ).partial(options=str(options), members=", ".join(members))
 
-llm = ChatOpenAI(model="gpt-4o-mini")
+# Answers are cached per normalized prompt, model and bound functions, see llm_cache
+# stream_usage keeps the token usage of streamed answers for the request budget
+llm = ChatOpenAI(model="gpt-4o-mini", cache=llm_cache, stream_usage=True)
 
 supervisor_chain = (
     prompt
@@ -167,15 +228,16 @@ class AgentState(TypedDict):
     next: str
 
 def create_agent_graph() -> StateGraph:
-    tracer_agent = create_agent(llm, nwpi_tools, remove_white_spaces(TRACER_PROMPT))
-    tracer_node = functools.partial(agent_node, agent=tracer_agent, name="Tracer")
-    reviewer_agent = create_agent(llm, reviewer_tools, remove_white_spaces(REVIEWER_PROMPT))
-    reviewer_node = functools.partial(agent_node, agent=reviewer_agent, name="Reviewer")
+    tracer_agent = create_agent(llm, nwpi_tools, TRACER_SYSTEM_PROMPT)
+    tracer_node = create_agent_node(tracer_agent, "Tracer")
+    reviewer_agent = create_agent(llm, reviewer_tools, REVIEWER_SYSTEM_PROMPT)
+    reviewer_node = create_agent_node(reviewer_agent, "Reviewer")
 
     workflow = StateGraph(AgentState)
     workflow.add_node("Tracer", tracer_node)
     workflow.add_node("Reviewer", reviewer_node)
-    workflow.add_node("supervisor", supervisor_chain)
+    # Deterministic transitions are routed by rules, the LLM supervisor only decides the others
+    workflow.add_node("supervisor", create_supervisor_node(supervisor_chain))
 
 
     for member in members:
@@ -189,16 +251,34 @@ def create_agent_graph() -> StateGraph:
     workflow.add_edge(START, "supervisor")
 
     graph = workflow.compile()
-   
-    graph.get_graph(xray=True).draw_mermaid_png(output_file_path="output_xray sec.png")
 
     return graph
 
 
+def draw_agent_graph(graph, output_file_path: str = "output_xray sec.png") -> None:
+    """
+    Draw the agent graph. A .png is rendered by the mermaid.ink service, any other extension gets the mermaid source.
+    """
+    drawable = graph.get_graph(xray=True)
+    if output_file_path.endswith(".png"):
+        drawable.draw_mermaid_png(output_file_path=output_file_path)
+    else:
+        with open(output_file_path, "w") as file:
+            file.write(drawable.draw_mermaid())
+    print("Agent graph written to", output_file_path)
+
+
 if __name__ == "__main__":
-    # agent = create_agent_graph()
-    # chat = agent.chat(
-    #     "please provide a summary of all activities I asked you to check in our conversation"
-    # )
-    # print(chat)
-    print("#" * 80, "\n")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="SD-WAN agent graph tools")
+    parser.add_argument(
+        "--draw-graph",
+        nargs="?",
+        const="output_xray sec.png",
+        metavar="PATH",
+        help="draw the agent graph, .png or mermaid source (.mmd)",
+    )
+    args = parser.parse_args()
+    if args.draw_graph:
+        draw_agent_graph(create_agent_graph(), args.draw_graph)
+    else:
+        parser.print_help()
\ No newline at end of file
@@ -0,0 +1,191 @@
+"""
+This module provides the cache of LLM answers used by the supervisor and the agent executors.
+
+Answers are keyed by the normalized prompt messages and the model string, which
+includes the model name, its parameters and the bound tools. They are kept
+in an in-memory LRU and, when LLM_CACHE_PATH is set, in a SQLite file that
+survives restarts. Every entry expires after a TTL: expired entries are deleted
+when they are looked up and the file is swept every PRUNE_INTERVAL seconds,
+which also keeps it to the LLM_CACHE_MAX_ROWS entries that expire last.
+
+The TTL and the opt-out are set per graph node with `llm_cache_scope`. Prompts
+that already contain a tool result are never cached, because their answer
+depends on live vManage data.
+"""
+import contextlib
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES = 512
+MAX_DB_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ROWS", "10000"))
+PRUNE_INTERVAL = 300
+DEFAULT_TTL = int(os.getenv("LLM_CACHE_TTL", "3600"))
+# Message types whose content comes from a tool call
+LIVE_DATA_MESSAGES = ('"FunctionMessage"', '"ToolMessage"')
+# Fields that change between identical messages
+VOLATILE_FIELDS = {"id", "response_metadata", "usage_metadata"}
+
+# TTL in seconds of the current graph node, None disables the cache
+_scope_ttl = contextvars.ContextVar("llm_cache_ttl", default=DEFAULT_TTL)
+
+
+@contextlib.contextmanager
+def llm_cache_scope(ttl: Optional[int] = DEFAULT_TTL):
+    """
+    Set the cache TTL of the LLM calls made inside the block, None to not cache them.
+    """
+    token = _scope_ttl.set(ttl)
+    try:
+        yield
+    finally:
+        _scope_ttl.reset(token)
+
+
+def _normalize(value):
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items() if key not in VOLATILE_FIELDS}
+    if isinstance(value, list):
+        return [_normalize(item) for item in value]
+    if isinstance(value, str):
+        return " ".join(value.split())
+    return value
+
+
+def cache_key(prompt: str, llm_string: str) -> str:
+    """
+    Hash the serialized messages, without volatile fields and with collapsed whitespace, and the model string.
+    """
+    try:
+        normalized = json.dumps(_normalize(json.loads(prompt)), sort_keys=True)
+    except ValueError:
+        normalized = " ".join(prompt.split())
+    return hashlib.sha256((normalized + "\x00" + llm_string).encode()).hexdigest()
+
+
+class LLMResponseCache(BaseCache):
+    """
+    This class is a LangChain cache with an in-memory LRU tier and an optional SQLite tier.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = MAX_ENTRIES, max_db_entries: int = MAX_DB_ENTRIES):
+        self.max_entries = max_entries
+        self.max_db_entries = max_db_entries
+        self._pruned_at = 0.0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_expires_at ON llm_cache (expires_at)")
+            self._prune(time.time())
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def _bypass(self, prompt: str) -> bool:
+        return _scope_ttl.get() is None or any(name in prompt for name in LIVE_DATA_MESSAGES)
+
+    def lookup(self, prompt: str, llm_string: str):
+        if self._bypass(prompt):
+            with self._lock:
+                self.bypassed += 1
+            return None
+        key = cache_key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._conn is not None:
+                row = self._conn.execute("SELECT value, expires_at FROM llm_cache WHERE key=?", (key,)).fetchone()
+                if row is not None:
+                    entry = (row[1], loads(row[0]))
+                    self._remember(key, entry)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._forget(key)
+            self.misses += 1
+            return None
+
+    def update(self, prompt: str, llm_string: str, return_val) -> None:
+        if self._bypass(prompt):
+            return
+        key = cache_key(prompt, llm_string)
+        entry = (time.time() + _scope_ttl.get(), list(return_val))
+        with self._lock:
+            self._remember(key, entry)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?)", (key, dumps(entry[1]), entry[0])
+                )
+                if time.monotonic() - self._pruned_at >= PRUNE_INTERVAL:
+                    self._prune(time.time())
+
+    def _remember(self, key: str, entry: tuple) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _forget(self, key: str) -> None:
+        self._entries.pop(key, None)
+        if self._conn is not None:
+            self._conn.execute("DELETE FROM llm_cache WHERE key=?", (key,))
+
+    def _prune(self, now: float) -> None:
+        # Expired rows go first, then the ones that expire first above the row bound
+        self._pruned_at = time.monotonic()
+        expired = self._conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,)).rowcount
+        evicted = self._conn.execute(
+            "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_db_entries,),
+        ).rowcount
+        if expired or evicted:
+            logger.info("LLM_CACHE_PRUNED: %s expired, %s evicted", expired, evicted)
+
+    async def alookup(self, prompt: str, llm_string: str):
+        # Lookups are local and fast, the executor hop of the default implementation would lose the scope
+        return self.lookup(prompt, llm_string)
+
+    async def aupdate(self, prompt: str, llm_string: str, return_val) -> None:
+        self.update(prompt, llm_string, return_val)
+
+    def clear(self, **kwargs) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM llm_cache")
+
+    async def aclear(self, **kwargs) -> None:
+        self.clear(**kwargs)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+llm_cache = LLMResponseCache(os.getenv("LLM_CACHE_PATH"))
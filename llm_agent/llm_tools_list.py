@@ -6,6 +6,10 @@ from nwpi import(
     get_entry_time_and_state,
     get_flow_summary,
     get_flow_detail,
+    get_flow_details,
+    start_multi_site_trace,
+    multi_site_trace_readout,
+    get_multi_site_flow_summary,
     reviewer_wait,
     tracer_wait,
 
@@ -18,6 +22,10 @@ nwpi_tools = [
     get_entry_time_and_state,
     get_flow_summary,
     get_flow_detail,
+    get_flow_details,
+    start_multi_site_trace,
+    multi_site_trace_readout,
+    get_multi_site_flow_summary,
     tracer_wait,
 ]
 reviewer_tools = [
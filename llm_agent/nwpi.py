@@ -1,12 +1,27 @@
+import asyncio
+import heapq
+import ipaddress
 import json
-import requests
 from dotenv import load_dotenv
 import os
-import re
 from langchain.agents import tool
 from typing import List, Optional
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from vmanage_cache import ResponseCache
+from vmanage_client import (
+    STREAM_CHUNK_SIZE,
+    AsyncVManageClient,
+    VManageClient,
+    aiter_json_items,
+    iter_json_items,
+)
+from trace_index import TraceHistoryIndex, is_final, trace_state
+from device_inventory import DeviceInventory
+import trace_store as trace_results
+from flow_detail import FlowDetailBuilder
+from records import EventRecord, FlowRecord, HopRecord, table_is_empty, to_table
 load_dotenv()
 
 
@@ -15,44 +30,32 @@ vmanage_port = os.getenv("VMANAGE_PORT")
 vmanage_username = os.getenv("VMANAGE_USER")
 vmanage_password = os.getenv("VMANAGE_PASS")
 
-class Authentication:
-
-    @staticmethod
-    def get_jsessionid(vmanage_host, vmanage_port, username, password):
-        api = "/j_security_check"
-        base_url = "https://%s:%s"%(vmanage_host, vmanage_port)
-        url = base_url + api
-        payload = {'j_username' : username, 'j_password' : password}
-
-        response = requests.post(url=url, data=payload, verify=False)
-        try:
-            cookies = response.headers["Set-Cookie"]
-            jsessionid = cookies.split(";")
-            return(jsessionid[0])
-        except:
-            print("No valid JSESSION ID returned\n")
-            exit()
-
-    @staticmethod
-    def get_token(vmanage_host, vmanage_port, jsessionid):
-        headers = {'Cookie': jsessionid}
-        base_url = "https://%s:%s"%(vmanage_host, vmanage_port)
-        api = "/dataservice/client/token"
-        url = base_url + api      
-        response = requests.get(url=url, headers=headers, verify=False)
-        if response.status_code == 200:
-            return(response.text)
-        else:
-            return None
+# Upper bound and polling schedule of tracer_wait, in seconds
+TRACE_READY_MAX_WAIT = int(os.getenv("TRACE_READY_MAX_WAIT", "90"))
+TRACE_READY_FIRST_POLL = 3
+TRACE_READY_MAX_POLL = 15
+TRACE_READY_BACKOFF = 1.5
+
+# Concurrent flowDetail requests of one get_flow_details call
+FLOW_DETAIL_WORKERS = 4
+
+# Flows returned by get_flow_summary unless the agent asks for another number
+FLOW_SUMMARY_TOP_N = 25
+
+# Oldest software version of the trace devices that supports the QoS monitor
+QOS_MIN_VERSION = (17, 9)
 
-Auth = Authentication()
-jsessionid = Auth.get_jsessionid(vmanage_host,vmanage_port,vmanage_username,vmanage_password)
-token = Auth.get_token(vmanage_host,vmanage_port,jsessionid)
+# Sites handled concurrently by the multi-site tools, bounds the parallel requests to vManage
+MULTI_SITE_WORKERS = 4
 
-if token is not None:
-    header = {'Content-Type': "application/json",'Cookie': jsessionid, 'X-XSRF-TOKEN': token}
-else:
-    header = {'Content-Type': "application/json",'Cookie': jsessionid}
+vmanage_cache = ResponseCache()
+# The clients log in on their first request, importing this module never contacts vManage
+vmanage = VManageClient(vmanage_host, vmanage_port, vmanage_username, vmanage_password, cache=vmanage_cache)
+avmanage = AsyncVManageClient(vmanage_host, vmanage_port, vmanage_username, vmanage_password, cache=vmanage_cache)
+trace_history = TraceHistoryIndex(vmanage, avmanage)
+device_inventory = DeviceInventory(vmanage, avmanage)
+# Results of stopped traces, they never change once the trace has stopped
+trace_store = trace_results.from_env()
 
 @tool
 def get_device_details_from_site(site: int) -> list:
@@ -69,33 +72,14 @@ def get_device_details_from_site(site: int) -> list:
 
 def _get_device_details_from_site(site: int) -> list:
 
-    url = "https://%s/dataservice/health/devices?page_size=12000&site-id=%s"%(vmanage_host, site)
+    # Answered from the in-memory inventory, refreshed in bulk for every site
+    return [device.trace_device() for device in device_inventory.devices_at_site(site)]
 
-    response = requests.request("GET", url, headers=header, verify=False)
-    
-    device_list = []
-    if response.status_code == 200:
-        resp = response.json()
+async def _aget_device_details_from_site(site: int) -> list:
 
-        device_list = []
-        for device in resp["devices"]:
-            if device["reachability"] == "reachable":
-                system_ip = device["system_ip"]
-                uuid = device["uuid"]
-                version = device["software_version"]
-        
-            device_info = {
-                "local-system-ip": system_ip,
-                "deviceId" : system_ip,
-                "uuid" : uuid,
-                "version" : version
-            }
-            
-            device_list.append(device_info)   
-        return device_list 
-    else:
-        print("Error:", response.status_code)
-        return []
+    return [device.trace_device() for device in await device_inventory.adevices_at_site(site)]
+
+get_device_details_from_site.coroutine = _aget_device_details_from_site
 
 @tool
 def start_trace(device_list: list, site: str, vpn: str, src: Optional[str] = "", dst: Optional[str]="") -> tuple[str,int,str]:
@@ -117,27 +101,36 @@ def start_trace(device_list: list, site: str, vpn: str, src: Optional[str] = "",
 
 def _start_trace(device_list: list, site: str, vpn: str, src: Optional[str] = "", dst: Optional[str]="") -> tuple[str,int,str]:
 
-    url = "https://%s/dataservice/stream/device/nwpi/trace/start"%(vmanage_host)
-    qos = "true"
+    api = "/stream/device/nwpi/trace/start"
+    payload = _start_trace_payload(device_list, site, vpn, src, dst)
+
+    response = vmanage.post(api, data=payload)
+    print(payload)
+    return _parse_start_trace(response)
+
+async def _astart_trace(device_list: list, site: str, vpn: str, src: Optional[str] = "", dst: Optional[str]="") -> tuple[str,int,str]:
 
+    api = "/stream/device/nwpi/trace/start"
+    payload = _start_trace_payload(device_list, site, vpn, src, dst)
+
+    response = await avmanage.post(api, content=payload)
+    print(payload)
+    return _parse_start_trace(response)
 
-    version_dict = {}
-    version_list = []
-    for device in device_list:
-        version_string = device["version"]
-        numeric_version = re.sub(r'\D', '', version_string)
-        version = int(numeric_version[:4])
-        version_dict[version] = version_string
-        version_list.append(version)
-    min_version = min(version_list)
+start_trace.coroutine = _astart_trace
+
+def _start_trace_payload(device_list: list, site: str, vpn: str, src: Optional[str] = "", dst: Optional[str]="") -> str:
+
+    qos = "true"
+
+    # (parsed version, version string) of the oldest device
+    min_version, source_version = min(device_inventory.version_of(device) for device in device_list)
 
     # If version is lower than 17.09 de-activate qos monitor
-    if min_version < 1709:
+    if min_version < QOS_MIN_VERSION:
         qos = "false"
-    
-    source_version  = version_dict[min_version]
 
-    payload = json.dumps({
+    return json.dumps({
     "source-site": site,
     "device-list": device_list,
     "vpn-id": vpn,
@@ -153,8 +146,8 @@ def _start_trace(device_list: list, site: str, vpn: str, src: Optional[str] = ""
     "source-site-version": source_version
     })
 
-    response = requests.request("POST", url, headers=header, data=payload, verify=False)
-    print(payload)
+def _parse_start_trace(response) -> tuple[str,int,str]:
+
     if response.status_code == 200:
         resp = response.json()
         print(resp)
@@ -185,21 +178,21 @@ def verify_trace_state(trace_id: int) -> tuple[str,str]:
 
 def _verify_trace_state(trace_id: int) -> tuple[str,str]:
 
-    url = "https://%s/dataservice/stream/device/nwpi/traceHistory"%(vmanage_host)
+    return _trace_state_and_message(trace_history.lookup(trace_id))
 
-    response = requests.request("GET", url, headers=header, verify=False)
+async def _averify_trace_state(trace_id: int) -> tuple[str,str]:
 
-    if response.status_code == 200:
-        resp = response.json()
-        traces = resp["data"]
-        state = ""
-        message = ""
-        for trace in traces:
-            if trace["trace-id"] == trace_id:
-                state = trace["data"]["summary"]["state"]
-                message = trace["data"]["summary"]["message"]                
-                return state, message
-    
+    return _trace_state_and_message(await trace_history.alookup(trace_id))
+
+verify_trace_state.coroutine = _averify_trace_state
+
+def _trace_state_and_message(trace: Optional[dict]) -> tuple[str,str]:
+
+    state = ""
+    message = ""
+    if trace is not None:
+        state = trace["data"]["summary"]["state"]
+        message = trace["data"]["summary"]["message"]
     return state, message
 
 @tool
@@ -215,24 +208,54 @@ def trace_readout(trace_id: int, timestamp: int) -> dict:
 
     Returns:
     events_exist (bool): True indicates there are flows detected, false indicate there are no flows detected.
-    all_events (list): Dictionary with the events detected. The key represents tha application and the value contains type of event and hops affected. An empty dictionary mean there are no events impacting traffic. 
+    all_events (dict): Table of the events detected, one row per application and type of event with the hops affected. No rows mean there are no events impacting traffic. 
 
     """
     return _trace_readout(trace_id, timestamp)
 
 def _trace_readout(trace_id: int, timestamp: int) -> tuple[bool,dict]:
 
-    url = "https://%s/dataservice/stream/device/nwpi/eventReadoutByTraces?trace_id=%s&entry_time=%s"%(vmanage_host, trace_id, timestamp)
+    stored = trace_store.get("readout", trace_id, timestamp)
+    if stored is not None:
+        return tuple(stored)
+
+    api = "/stream/device/nwpi/eventReadoutByTraces?trace_id=%s&entry_time=%s"%(trace_id, timestamp)
+
+    response = vmanage.get(api)
+    readout = _parse_trace_readout(response)
+    if response.status_code == 200:
+        _keep_if_stopped("readout", trace_id, timestamp, "", readout)
+    return readout
+
+async def _atrace_readout(trace_id: int, timestamp: int) -> tuple[bool,dict]:
+
+    stored = trace_store.get("readout", trace_id, timestamp)
+    if stored is not None:
+        return tuple(stored)
+
+    api = "/stream/device/nwpi/eventReadoutByTraces?trace_id=%s&entry_time=%s"%(trace_id, timestamp)
+
+    response = await avmanage.get(api)
+    readout = _parse_trace_readout(response)
+    if response.status_code == 200:
+        await _akeep_if_stopped("readout", trace_id, timestamp, "", readout)
+    return readout
+
+trace_readout.coroutine = _atrace_readout
 
-    response = requests.request("GET", url, headers=header,verify=False)
+def _parse_trace_readout(response) -> tuple[bool,dict]:
 
+    events_exist = False
+    # (application, event) -> EventRecord, a repeated event keeps the hops of the last one
+    all_events = {}
     if response.status_code == 200:
         resp = response.json()
-        data = resp.get("data",{})
+        data = resp.get("data",[])
+        if len(data) == 0:
+            # No readout yet, the trace has not reported anything
+            return events_exist, to_table([], EventRecord)
 
         events = data[0]["detail"]
-        events_exist = False
-        all_events = {}
         if len(events) > 0:
             events_exist = True
             for app in events:
@@ -241,15 +264,53 @@ def _trace_readout(trace_id: int, timestamp: int) -> tuple[bool,dict]:
                         hop_with_edge = []
                         for hop_statistics in event_hop_statistics["hopStatistics"]:
                             hop_with_edge.append(hop_statistics["hopWithEdge"])
-                        app_name = app["application"]
+                        app_name = app["application"].upper()
                         event = event_hop_statistics["event"]
-                        all_events.update(
-                            {app_name.upper()+"_"+event: hop_with_edge}
-                        )
-            return events_exist, all_events
+                        all_events[(app_name, event)] = EventRecord(app_name, event, hop_with_edge)
     else:
         print("Error:", response.status_code)
-    return events_exist, all_events
+    return events_exist, to_table(list(all_events.values()), EventRecord)
+
+
+def _event_applications(trace_id: int, timestamp: int) -> set:
+
+    api = "/stream/device/nwpi/eventReadoutByTraces?trace_id=%s&entry_time=%s"%(trace_id, timestamp)
+
+    response = vmanage.get(api)
+    return _parse_event_applications(response)
+
+async def _aevent_applications(trace_id: int, timestamp: int) -> set:
+
+    api = "/stream/device/nwpi/eventReadoutByTraces?trace_id=%s&entry_time=%s"%(trace_id, timestamp)
+
+    response = await avmanage.get(api)
+    return _parse_event_applications(response)
+
+def _parse_event_applications(response) -> set:
+
+    # Names of the applications with at least one event in the readout
+    event_apps = set()
+    if response.status_code == 200:
+        data = response.json().get("data",[])
+        if len(data) > 0:
+            for app in data[0]["detail"]:
+                if len(app["eventHopStatistics"]) > 0:
+                    event_apps.add(app["application"])
+    return event_apps
+
+
+def _keep_if_stopped(kind: str, trace_id: int, timestamp: int, key: str, result) -> None:
+
+    # Results of running traces can still change and are never stored
+    trace = trace_history.lookup(trace_id)
+    if trace is not None and is_final(trace):
+        trace_store.put(kind, trace_id, timestamp, key, result)
+
+async def _akeep_if_stopped(kind: str, trace_id: int, timestamp: int, key: str, result) -> None:
+
+    trace = await trace_history.alookup(trace_id)
+    if trace is not None and is_final(trace):
+        trace_store.put(kind, trace_id, timestamp, key, result)
 
 
 @tool
@@ -266,13 +327,26 @@ def get_site_list() -> list:
 
 def _get_site_list() -> list:
 
-    url = "https://%s/dataservice/statistics/sitehealth/common?interval=30"%(vmanage_host)
+    api = "/statistics/sitehealth/common?interval=30"
+
+    response = vmanage.get(api)
+    return _parse_site_list(response)
+
+async def _aget_site_list() -> list:
+
+    api = "/statistics/sitehealth/common?interval=30"
 
-    response = requests.request("GET", url, headers=header, verify=False)
+    response = await avmanage.get(api)
+    return _parse_site_list(response)
+
+get_site_list.coroutine = _aget_site_list
+
+def _parse_site_list(response) -> list:
+
+    site_list = []
     if response.status_code == 200:
         data = response.json()
         list = data.get("data",{})
-        site_list = []
         if len(list) > 0:
             for site in list:
                 site_list.append(site["site_id"])
@@ -300,22 +374,21 @@ def get_entry_time_and_state(trace_id: int) -> tuple[int,str]:
 
 def _get_entry_time_and_state(trace_id: int) -> tuple[int,str]:
 
-    url = "https://%s/dataservice/stream/device/nwpi/traceHistory"%(vmanage_host)
+    return _trace_entry_time_and_state(trace_history.lookup(trace_id))
+
+async def _aget_entry_time_and_state(trace_id: int) -> tuple[int,str]:
+
+    return _trace_entry_time_and_state(await trace_history.alookup(trace_id))
+
+get_entry_time_and_state.coroutine = _aget_entry_time_and_state
 
-    response = requests.request("GET", url, headers=header, verify=False)
+def _trace_entry_time_and_state(trace: Optional[dict]) -> tuple[int,str]:
 
     entry_time = 0
     state = ""
-    if response.status_code == 200:
-        resp = response.json()
-        print(resp, "entry time and state")
-        traces = resp["data"]
-        for trace in traces:
-            if trace["trace-id"] == trace_id:
-                entry_time = trace["entry_time"]
-                state = trace["data"]["summary"]["state"]
-                return entry_time, state
-    
+    if trace is not None:
+        entry_time = trace["entry_time"]
+        state = trace["data"]["summary"]["state"]
     return entry_time, state
 
 # @tool
@@ -340,9 +413,9 @@ def _get_entry_time_and_state(trace_id: int) -> tuple[int,str]:
 
 # def _get_aggregate_data(trace_id: int, timestamp: int, traceState: str) -> tuple[list,int,int]:
 
-#     url = "https://%s/dataservice/stream/device/nwpi/aggFlow?traceId=%s&timestamp=%s&traceState=%s"%(vmanage_host, trace_id, timestamp, traceState)
+#     api = "/stream/device/nwpi/aggFlow?traceId=%s&timestamp=%s&traceState=%s"%(trace_id, timestamp, traceState)
 
-#     response = requests.request("GET", url, headers=header, verify=False)
+#     response = vmanage.get(api)
 
 
 #     if response.status_code == 200:
@@ -395,32 +468,190 @@ def _get_entry_time_and_state(trace_id: int) -> tuple[int,str]:
 
 
 @tool
-def get_flow_summary(trace_id: int, timestamp: int, start_time: int, end_time: int) -> tuple[int,str]:
+def get_flow_summary(trace_id: int, timestamp: int, start_time: int = 0, end_time: int = 0, application: Optional[str] = "", src_prefix: Optional[str] = "", dst_prefix: Optional[str] = "", protocol: Optional[str] = "", with_events: bool = False, top_n: int = FLOW_SUMMARY_TOP_N) -> dict:
 
     """
-    Get information of the flows captured by the trace. 
+    Get information of the flows captured by the trace. Use the optional filters to only get the flows the user is asking about.
 
     Args:
         trace_id (int): Trace ID to retrieve the entry time from. 
         timestamp (int): Timestamp of trace
-        start_time (int): Start time to filter query. This comes from get_aggregate_data function
-        end_time (int): End time to filter query. This comes from get_aggregate_data function
+        start_time (int): Optional - Epoch start time in ms to filter query, 0 to use the trace start.
+        end_time (int): Optional - Epoch end time in ms to filter query, 0 to use one hour after the trace start.
+        application (str): Optional - Application name of the flows, as reported by vManage.
+        src_prefix (str): Optional - Source host or subnet of the flows, e.g. 10.1.1.0/24.
+        dst_prefix (str): Optional - Destination host or subnet of the flows.
+        protocol (str): Optional - Protocol of the flows, e.g. TCP or UDP.
+        with_events (bool): Optional - Only return flows of applications with events in the trace readout.
+        top_n (int): Optional - Maximum number of flows to return, flows with events and most recent first.
 
     Returns:
-       flow_summary (list): Summary information of the captured flows
+       flow_summary (dict): "flows_matched" is the number of flows matching the filters, "flows" a table of the top ones with their flow_id and device_trace_id.
     """
 
-    return _get_flow_summary(trace_id, timestamp, start_time, end_time)
+    return _get_flow_summary(trace_id, timestamp, start_time, end_time, application, src_prefix, dst_prefix, protocol, with_events, top_n)
 
-def _get_flow_summary(trace_id: int, timestamp: int, start_time: int, end_time: int) -> tuple[int,str]:
+def _get_flow_summary(trace_id: int, timestamp: int, start_time: int = 0, end_time: int = 0, application: Optional[str] = "", src_prefix: Optional[str] = "", dst_prefix: Optional[str] = "", protocol: Optional[str] = "", with_events: bool = False, top_n: int = FLOW_SUMMARY_TOP_N) -> dict:
 
-    url = "https://%s/dataservice/stream/device/nwpi/traceFinFlowWithQuery?traceId=%s&timestamp=%s"%(vmanage_host,trace_id,timestamp)
+    key = _flow_summary_key(start_time, end_time, application, src_prefix, dst_prefix, protocol, with_events, top_n)
+    stored = trace_store.get("flow_summary", trace_id, timestamp, key)
+    if stored is not None:
+        return stored
 
-    start_time,end_time = calculate_times(timestamp)
-    payload = json.dumps({
-        "query": {
-            "condition": "AND",
-            "rules": [
+    flow_summary = _fetch_flow_summary(trace_id, timestamp, start_time, end_time, application, src_prefix, dst_prefix, protocol, with_events, top_n)
+    if flow_summary is None:
+        return _TopFlows(top_n).summary()
+    _keep_if_stopped("flow_summary", trace_id, timestamp, key, flow_summary)
+    return flow_summary
+
+def _fetch_flow_summary(trace_id: int, timestamp: int, start_time: int = 0, end_time: int = 0, application: Optional[str] = "", src_prefix: Optional[str] = "", dst_prefix: Optional[str] = "", protocol: Optional[str] = "", with_events: bool = False, top_n: int = FLOW_SUMMARY_TOP_N) -> Optional[dict]:
+
+    filters = _flow_filters(application, src_prefix, dst_prefix, protocol)
+    # The flows are ranked while they stream, so the applications with events are needed first
+    event_apps = _event_applications(trace_id, timestamp)
+    if with_events and len(event_apps) == 0:
+        return _TopFlows(top_n, event_apps).summary()
+
+    api = "/stream/device/nwpi/traceFinFlowWithQuery?traceId=%s&timestamp=%s"%(trace_id,timestamp)
+    payload = _flow_summary_payload(timestamp, start_time, end_time, filters, event_apps if with_events else None)
+
+    # Flows are filtered and ranked while the body is parsed, only the top_n are held in memory
+    top_flows = _TopFlows(top_n, event_apps)
+    with vmanage.stream("GET", api, data=payload) as response:
+        if response.status_code != 200:
+            print("Error:", response.status_code)
+            return None
+        event_keys = top_flows.event_keys if with_events else None
+        for flow in iter_json_items(response.iter_content(STREAM_CHUNK_SIZE), "data.item"):
+            if _flow_matches(flow["data"], filters, event_keys):
+                top_flows.add(flow["data"])
+
+    _remember_device_traces(trace_id, timestamp, top_flows.device_trace_ids)
+    return top_flows.summary()
+
+async def _aget_flow_summary(trace_id: int, timestamp: int, start_time: int = 0, end_time: int = 0, application: Optional[str] = "", src_prefix: Optional[str] = "", dst_prefix: Optional[str] = "", protocol: Optional[str] = "", with_events: bool = False, top_n: int = FLOW_SUMMARY_TOP_N) -> dict:
+
+    key = _flow_summary_key(start_time, end_time, application, src_prefix, dst_prefix, protocol, with_events, top_n)
+    stored = trace_store.get("flow_summary", trace_id, timestamp, key)
+    if stored is not None:
+        return stored
+
+    flow_summary = await _afetch_flow_summary(trace_id, timestamp, start_time, end_time, application, src_prefix, dst_prefix, protocol, with_events, top_n)
+    if flow_summary is None:
+        return _TopFlows(top_n).summary()
+    await _akeep_if_stopped("flow_summary", trace_id, timestamp, key, flow_summary)
+    return flow_summary
+
+async def _afetch_flow_summary(trace_id: int, timestamp: int, start_time: int = 0, end_time: int = 0, application: Optional[str] = "", src_prefix: Optional[str] = "", dst_prefix: Optional[str] = "", protocol: Optional[str] = "", with_events: bool = False, top_n: int = FLOW_SUMMARY_TOP_N) -> Optional[dict]:
+
+    filters = _flow_filters(application, src_prefix, dst_prefix, protocol)
+    event_apps = await _aevent_applications(trace_id, timestamp)
+    if with_events and len(event_apps) == 0:
+        return _TopFlows(top_n, event_apps).summary()
+
+    api = "/stream/device/nwpi/traceFinFlowWithQuery?traceId=%s&timestamp=%s"%(trace_id,timestamp)
+    payload = _flow_summary_payload(timestamp, start_time, end_time, filters, event_apps if with_events else None)
+
+    top_flows = _TopFlows(top_n, event_apps)
+    async with avmanage.stream("GET", api, content=payload) as response:
+        if response.status_code != 200:
+            print("Error:", response.status_code)
+            return None
+        event_keys = top_flows.event_keys if with_events else None
+        async for flow in aiter_json_items(response.aiter_bytes(STREAM_CHUNK_SIZE), "data.item"):
+            if _flow_matches(flow["data"], filters, event_keys):
+                top_flows.add(flow["data"])
+
+    _remember_device_traces(trace_id, timestamp, top_flows.device_trace_ids)
+    return top_flows.summary()
+
+get_flow_summary.coroutine = _aget_flow_summary
+
+def _flow_summary_key(start_time: int = 0, end_time: int = 0, application: Optional[str] = "", src_prefix: Optional[str] = "", dst_prefix: Optional[str] = "", protocol: Optional[str] = "", with_events: bool = False, top_n: int = FLOW_SUMMARY_TOP_N) -> str:
+
+    # Every argument that changes the answer is part of the stored result key
+    return json.dumps([start_time, end_time, application or "", src_prefix or "", dst_prefix or "", protocol or "", with_events, top_n])
+
+def _remember_device_traces(trace_id: int, timestamp: int, device_trace_ids: set) -> None:
+
+    # flowDetail is queried by device trace, keep the trace it belongs to for the result store
+    for device_trace_id in device_trace_ids:
+        trace_store.remember_device_trace(device_trace_id, timestamp, trace_id)
+
+def _flow_filters(application: Optional[str] = "", src_prefix: Optional[str] = "", dst_prefix: Optional[str] = "", protocol: Optional[str] = "") -> dict:
+
+    filters = {}
+    if application:
+        filters["app_name"] = application
+    if protocol:
+        filters["protocol"] = protocol
+    for field, prefix in (("src_ip", src_prefix), ("dst_ip", dst_prefix)):
+        if prefix:
+            try:
+                filters[field] = ipaddress.ip_network(prefix.strip(), strict=False)
+            except ValueError:
+                print("Ignoring invalid prefix:", prefix)
+    return filters
+
+def _upper_names(names: Optional[set]) -> Optional[set]:
+
+    return None if names is None else {name.upper() for name in names}
+
+def _flow_matches(flow: dict, filters: dict, event_apps: Optional[set]) -> bool:
+
+    # vManage releases that ignore some query rules still get the same result
+    for field in ("app_name", "protocol"):
+        if field in filters and str(flow.get(field, "")).upper() != str(filters[field]).upper():
+            return False
+    for field in ("src_ip", "dst_ip"):
+        if field in filters:
+            try:
+                if ipaddress.ip_address(flow.get(field, "")) not in filters[field]:
+                    return False
+            except ValueError:
+                return False
+    if event_apps is not None and str(flow.get("app_name", "")).upper() not in event_apps:
+        return False
+    return True
+
+class _TopFlows:
+
+    """
+    Count the matching flows and keep the top_n of them, flows of applications with events and most recent first.
+    """
+
+    def __init__(self, top_n: int, event_apps: Optional[set] = None):
+        self.top_n = top_n
+        self.event_keys = _upper_names(event_apps) or set()
+        self.flows_matched = 0
+        self.device_trace_ids = set()
+        # Min-heap of (rank, arrival, record), the arrival keeps records from ever being compared
+        self._heap = []
+
+    def add(self, flow: dict) -> None:
+        record = FlowRecord.from_flow(flow)
+        self.flows_matched += 1
+        self.device_trace_ids.add(record.device_trace_id)
+        rank = (str(record.app_name).upper() in self.event_keys, flow.get("received_timestamp") or 0)
+        entry = (rank, -self.flows_matched, record)
+        if not self.top_n or len(self._heap) < self.top_n:
+            heapq.heappush(self._heap, entry)
+        elif entry > self._heap[0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def summary(self) -> dict:
+        flows = [record for _, _, record in sorted(self._heap, reverse=True)]
+        print(len(flows), "of", self.flows_matched, "flows in flow summary")
+        return {
+            "flows_matched": self.flows_matched,
+            "flows": to_table(flows, FlowRecord),
+        }
+
+def _flow_summary_payload(timestamp: int, start_time: int = 0, end_time: int = 0, filters: Optional[dict] = None, event_apps: Optional[set] = None) -> str:
+
+    if not (start_time and end_time and end_time > start_time):
+        start_time,end_time = calculate_times(timestamp)
+    rules = [
                 {
                     "value": [
                     start_time,
@@ -431,32 +662,26 @@ def _get_flow_summary(trace_id: int, timestamp: int, start_time: int, end_time:
                     "operator": "greater"
                 }
             ]
+    filters = filters or {}
+    # app_name and protocol come as the user typed them and vManage may match them case-sensitively,
+    # they are only filtered locally. Event applications are pushed with the names the readout returned.
+    for field in ("src_ip", "dst_ip"):
+        # Subnets are matched locally, only single hosts can be pushed as an "in" rule
+        if field in filters and filters[field].num_addresses == 1:
+            rules.append({"value": [str(filters[field].network_address)], "field": "data." + field, "type": "string", "operator": "in"})
+    if event_apps is not None and "app_name" not in filters:
+        rules.append({"value": sorted(event_apps), "field": "data.app_name", "type": "string", "operator": "in"})
+
+    return json.dumps({
+        "query": {
+            "condition": "AND",
+            "rules": rules
             }
         })
 
-    response = requests.request("GET", url, headers=header, verify=False, data=payload)
-
-
-    if response.status_code == 200:
-        resp = response.json()
-        print(resp, "flow summary")
-        flows = resp["data"]
-        flow_summary = []
-        for flow in flows:
-            flow_info = {
-                "Flow ID:" : flow["data"]["flow_id"],
-                "Device Trace ID:": flow["data"]["device_trace_id"],
-                "Source:": flow["data"]["src_ip"], 
-                "Destination:": flow["data"]["dst_ip"],
-                "Application:": flow["data"]["app_name"],
-                "Protocol:": flow["data"]["protocol"],
-                }
-            flow_summary.append(flow_info)
-        return flow_summary
-    
 
 @tool
-def get_flow_detail(device_trace_id: int, timestamp: int, flow_id: int) -> list[dict]:
+def get_flow_detail(device_trace_id: int, timestamp: int, flow_id: int) -> dict:
 
     """
     Get detailed information of one flow on one trace. 
@@ -467,217 +692,309 @@ def get_flow_detail(device_trace_id: int, timestamp: int, flow_id: int) -> list[
         flow_id (int): Flow number to get more information about. 
 
     Returns:
-       flow_detail_summary (list[dict]): Detailed information of the captured flows
+       flow_detail_summary (dict): "upstream" and "downstream" tables with one row per hop of the flow
     """
 
     return _get_flow_detail(device_trace_id, timestamp, flow_id)
 
-def _get_flow_detail(device_trace_id: int, timestamp: int, flow_id: int) -> list[dict]:
+def _get_flow_detail(device_trace_id: int, timestamp: int, flow_id: int) -> dict:
 
-    url = "https://%s/dataservice/stream/device/nwpi/flowDetail?traceId=%s&timestamp=%s&flowId=%s"%(vmanage_host,device_trace_id,timestamp,flow_id)
+    trace_id = trace_store.trace_of_device(device_trace_id, timestamp)
+    key = "%s:%s"%(device_trace_id, flow_id)
+    if trace_id is not None:
+        stored = trace_store.get("flow_detail", trace_id, timestamp, key)
+        if stored is not None:
+            return stored
 
-    response = requests.request("GET", url, headers=header, verify=False)
+    api = "/stream/device/nwpi/flowDetail?traceId=%s&timestamp=%s&flowId=%s"%(device_trace_id,timestamp,flow_id)
 
-    if response.status_code == 200:
-        traces = response.json()
-        print(traces, "flow details")
-        flow_detail_summary = []
-        upstream_list = []
-        downstream_list=[]
-        timestamps = []
-        events = []
-        features = []
-        devices = []
-        midpoint = len(traces) // 2
-        for trace in traces[:midpoint]:
-            if "received_timestamp" in trace["data"]:
-                if trace["data"]["received_timestamp"] not in timestamps and trace["data"]["device_name"] not in devices:
-                    timestamps.append(trace["data"]["received_timestamp"])
-                    devices.append(trace["data"]["device_name"])
-            else:
-                if trace["data"]["packet_received_timestamp"] not in timestamps and trace["data"]["device_name"] not in devices:
-                    timestamps.append(trace["data"]["packet_received_timestamp"])
-                    devices.append(trace["data"]["device_name"])
-
-        for timestamp in timestamps:
-            for trace in traces:
-                if "received_timestamp" in trace["data"]:
-                    if timestamp == trace["data"]["received_timestamp"]:
-                        events.append(trace)
-                if "packet_received_timestamp" in trace["data"]:
-                    if timestamp == trace["data"]["packet_received_timestamp"]:
-                        features.append(trace)
-        # print(events, "events")
-        # print(features, "features")
-        if len(events) > 0:
-            for event in events[::-1]:
-                for feature in features:
-                    if event["data"]["event_direction"] == "upstream" and event["data"]["packet_id"] == feature["data"]["packet"]["packet_id"]:
-                        upstream_list.append({   
-                                        "Hop": event["data"]["device_name"],
-                                        "Event": event["data"]["event_name"],
-                                        "Local Color" : replace_invalid_color(event,"local_color"),
-                                        "Remote Color": replace_invalid_color(event,"remote_color"),
-                                        "Ingress Intf": get_feature_detail(feature,"ingress_fia","Ingress Report"),
-                                        "Egress Intf": get_feature_detail(feature,"egress_fia","Transmit Report"),
-                                        "Ingress Features": get_features_summary(feature, "ingress_fia"),
-                                        "Egress Features": get_features_summary(feature, "egress_fia"),
-                                        "Fwd decision based on": feature["data"]["packet"]["packet_fwd_decision"]
-                                            })
-                        
-                    if event["data"]["event_direction"] == "downstream" and event["data"]["packet_id"] == feature["data"]["packet"]["packet_id"]:
-                        downstream_list.append({
-                                        "Hop": event["data"]["device_name"],
-                                        "Event": event["data"]["event_name"],
-                                        "Local Color" : replace_invalid_color(event,"local_color"),
-                                        "Remote Color": replace_invalid_color(event,"remote_color"),
-                                        "Ingress Intf": get_feature_detail(feature,"ingress_fia","Ingress Report"),
-                                        "Egress Intf": get_feature_detail(feature,"egress_fia","Transmit Report"),
-                                        "Ingress Features": get_features_summary(feature, "ingress_fia"),
-                                        "Egress Features": get_features_summary(feature, "egress_fia"),
-                                        "Fwd decision based on": feature["data"]["packet"]["packet_fwd_decision"]
-                                        })
-                
-            flow_detail_summary.append({"Upstream": upstream_list,
-                                    "Downstream" : list(reversed(downstream_list))})
-            
-            print(downstream_list, "downstream")
-            print(flow_detail_summary, "flow summary")
-        
-        else:
-            for feature in features:
-                sdwan_fwd = find_value_path(feature["data"]["packet"]["packet"], "SDWAN Forwarding")
-                key1 = sdwan_fwd[0]
-                position = sdwan_fwd[1]
-                key2 = "feature_detail"
-                if find_direction(feature["data"]["packet"]["packet"][key1][position][key2]) == "upstream":
-                    upstream_list.append({   
-                                    "Hop": feature["data"]["device_name"],
-                                    "Event": feature["data"]["packet"]["event_name"],
-                                    "Local Color" : find_text(feature["data"]["packet"]["packet"][key1][position][key2],"local"),
-                                    "Remote Color": find_text(feature["data"]["packet"]["packet"][key1][position][key2],"remote"),
-                                    "Ingress Intf": get_feature_detail(feature,"ingress_fia","Ingress Report"),
-                                    "Egress Intf": get_feature_detail(feature,"egress_fia","Transmit Report"),
-                                    "Ingress Features": get_features_summary(feature, "ingress_fia"),
-                                    "Egress Features": get_features_summary(feature, "egress_fia"),
-                                    "Fwd decision based on": feature["data"]["packet"]["packet_fwd_decision"]
-                                        })
-                    
-                if find_direction(feature["data"]["packet"]["packet"][key1][position][key2]) == "downstream":
-                    downstream_list.append({
-                                    "Hop": feature["data"]["device_name"],
-                                    "Event": feature["data"]["packet"]["event_name"],
-                                    "Local Color" : find_text(feature["data"]["packet"]["packet"][key1][position][key2],"local"),
-                                    "Remote Color": find_text(feature["data"]["packet"]["packet"][key1][position][key2],"remote"),
-                                    "Ingress Intf": get_feature_detail(feature,"ingress_fia","Ingress Report"),
-                                    "Egress Intf": get_feature_detail(feature,"egress_fia","Transmit Report"),
-                                    "Ingress Features": get_features_summary(feature, "ingress_fia"),
-                                    "Egress Features": get_features_summary(feature, "egress_fia"),
-                                    "Fwd decision based on": feature["data"]["packet"]["packet_fwd_decision"]
-                                    })
-            
-        flow_detail_summary.append({"Upstream": upstream_list,
-                                "Downstream" : list(reversed(downstream_list))})
-        
-        print(downstream_list, "downstream")
-        print(flow_detail_summary, "flow summary")
-
-        
-        return flow_detail_summary
-
-def find_direction(text) -> str:
-    # Compile regular expressions to search for 'dir:Upstream' or 'dir:Downstream'
-    upstream = re.compile(r'dir\s*:\s*Upstream', re.IGNORECASE)
-    downstream = re.compile(r'dir\s*:\s*Downstream', re.IGNORECASE)
-
-
-    if upstream.search(text):
-        return "upstream"
-
-    if downstream.search(text):
-        return "downstream"
-            
-    # Return 'not found' if neither pattern is present
-    return "not found"
-
-def find_text(text, pattern) -> str:
-    # Compile regular expressions to search for 'dir:Upstream' or 'dir:Downstream'
-    local_color = re.compile(r'Local\s+Color\s*:\s*([\w-]+)', re.IGNORECASE)
-    remote_color = re.compile(r'Remote\s+Color\s*:\s*([\w-]+)', re.IGNORECASE)
-            
-    if pattern == "local":
-        match = local_color.search(text)
-        if match:
-            return match.group(1)
-    
-    if pattern == "remote":
-        match = remote_color.search(text)
-        if match:
-            return match.group(1)
-    
-    # Return 'not found' if neither pattern is present
-    return "not found"
+    # Records are compacted by the builder as they are parsed, the full response is never held in memory
+    with vmanage.stream("GET", api) as response:
+        if response.status_code != 200:
+            print("Error:", response.status_code)
+            return _flow_detail_tables([], [])
+        builder = FlowDetailBuilder()
+        for trace in iter_json_items(response.iter_content(STREAM_CHUNK_SIZE), "item"):
+            builder.add(trace)
+
+    flow_detail_summary = _flow_detail_result(builder)
+    if trace_id is not None:
+        _keep_if_stopped("flow_detail", trace_id, timestamp, key, flow_detail_summary)
+    return flow_detail_summary
+
+async def _aget_flow_detail(device_trace_id: int, timestamp: int, flow_id: int) -> dict:
+
+    trace_id = trace_store.trace_of_device(device_trace_id, timestamp)
+    key = "%s:%s"%(device_trace_id, flow_id)
+    if trace_id is not None:
+        stored = trace_store.get("flow_detail", trace_id, timestamp, key)
+        if stored is not None:
+            return stored
+
+    api = "/stream/device/nwpi/flowDetail?traceId=%s&timestamp=%s&flowId=%s"%(device_trace_id,timestamp,flow_id)
+
+    async with avmanage.stream("GET", api) as response:
+        if response.status_code != 200:
+            print("Error:", response.status_code)
+            return _flow_detail_tables([], [])
+        builder = FlowDetailBuilder()
+        async for trace in aiter_json_items(response.aiter_bytes(STREAM_CHUNK_SIZE), "item"):
+            builder.add(trace)
+
+    flow_detail_summary = _flow_detail_result(builder)
+    if trace_id is not None:
+        await _akeep_if_stopped("flow_detail", trace_id, timestamp, key, flow_detail_summary)
+    return flow_detail_summary
+
+get_flow_detail.coroutine = _aget_flow_detail
+
+def _flow_detail_result(builder: FlowDetailBuilder) -> dict:
+
+    # Every entry of the builder result holds the same hop lists, the last one is used
+    hops = builder.result()[-1]
+    flow_detail_summary = _flow_detail_tables(hops["Upstream"], hops["Downstream"])
+    print(flow_detail_summary, "flow summary")
+    return flow_detail_summary
+
+def _flow_detail_tables(upstream: list[HopRecord], downstream: list[HopRecord]) -> dict:
+
+    return {
+        "upstream": to_table(upstream, HopRecord),
+        "downstream": to_table(downstream, HopRecord),
+    }
+
+@tool
+def get_flow_details(timestamp: int, flows: list[dict]) -> list[dict]:
+
+    """
+    Get detailed information of several flows of one trace at once. Only flows with hop information are returned.
+
+    Args:
+        timestamp (int): Timestamp of trace
+        flows (list[dict]): Flows to get more information about, each one as {"device_trace_id": int, "flow_id": int}. They come from get_flow_summary.
+
+    Returns:
+       flow_details (list[dict]): One entry per non-empty flow with its device_trace_id, flow_id and flow_detail.
+    """
+
+    return _get_flow_details(timestamp, flows)
+
+def _get_flow_details(timestamp: int, flows: list[dict]) -> list[dict]:
+
+    with ThreadPoolExecutor(max_workers=FLOW_DETAIL_WORKERS) as executor:
+        details = list(executor.map(
+            lambda flow: _get_flow_detail(flow["device_trace_id"], timestamp, flow["flow_id"]),
+            flows,
+        ))
+    return _non_empty_flow_details(flows, details)
+
+async def _aget_flow_details(timestamp: int, flows: list[dict]) -> list[dict]:
+
+    semaphore = asyncio.Semaphore(FLOW_DETAIL_WORKERS)
+
+    async def fetch(flow):
+        async with semaphore:
+            return await _aget_flow_detail(flow["device_trace_id"], timestamp, flow["flow_id"])
+
+    details = await asyncio.gather(*(fetch(flow) for flow in flows))
+    return _non_empty_flow_details(flows, details)
+
+get_flow_details.coroutine = _aget_flow_details
+
+def _non_empty_flow_details(flows: list[dict], details: list) -> list[dict]:
+
+    flow_details = []
+    for flow, flow_detail in zip(flows, details):
+        if not (table_is_empty(flow_detail["upstream"]) and table_is_empty(flow_detail["downstream"])):
+            flow_details.append({
+                "device_trace_id": flow["device_trace_id"],
+                "flow_id": flow["flow_id"],
+                "flow_detail": flow_detail,
+            })
+    print(len(flow_details), "of", len(flows), "flows with details")
+    return flow_details
+
+@tool
+def start_multi_site_trace(sites: list[int], vpn: str, src: Optional[str] = "", dst: Optional[str] = "") -> dict:
+    """
+    Start one trace per site on several sites at once. Use it instead of get_device_details_from_site and start_trace when the user asks about more than one site.
+
+    Args:
+        sites (list[int]): Sites where traces should be started. User must provide them.
+        vpn (str): VPN where the traces should be started. User must provide it.
+        src (str): Optional - Source subnet or host to filter the traces.
+        dst (str): Optional - Destination subnet or host to filter the traces.
+
+    Returns:
+        multi_site_trace (dict): "handle" identifies the traces in multi_site_trace_readout and get_multi_site_flow_summary, "traces" lists the site, trace_id, timestamp and status of each trace.
+    """
+    return _start_multi_site_trace(sites, vpn, src, dst)
+
+def _start_multi_site_trace(sites: list[int], vpn: str, src: Optional[str] = "", dst: Optional[str] = "") -> dict:
 
-def find_value_path(data, target):
+    def start(site):
+        device_list = _get_device_details_from_site(site)
+        if len(device_list) == 0:
+            return _site_trace(site, "", "", "no reachable devices")
+        return _site_trace(site, *_start_trace(device_list, str(site), vpn, src, dst))
+
+    with ThreadPoolExecutor(max_workers=MULTI_SITE_WORKERS) as executor:
+        traces = list(executor.map(start, sites))
+    return _register_multi_site_trace(traces)
+
+async def _astart_multi_site_trace(sites: list[int], vpn: str, src: Optional[str] = "", dst: Optional[str] = "") -> dict:
+
+    semaphore = asyncio.Semaphore(MULTI_SITE_WORKERS)
+
+    async def start(site):
+        async with semaphore:
+            device_list = await _aget_device_details_from_site(site)
+            if len(device_list) == 0:
+                return _site_trace(site, "", "", "no reachable devices")
+            return _site_trace(site, *await _astart_trace(device_list, str(site), vpn, src, dst))
+
+    traces = await asyncio.gather(*(start(site) for site in sites))
+    return _register_multi_site_trace(traces)
+
+start_multi_site_trace.coroutine = _astart_multi_site_trace
+
+def _site_trace(site: int, start_time, trace_id, status: str) -> dict:
+
+    return {"site": site, "trace_id": trace_id, "timestamp": start_time, "status": status}
+
+def _register_multi_site_trace(traces: list[dict]) -> dict:
+
+    # The handle survives restarts, the traces are kept in the trace store
+    handle = "sites-%s"%(trace_store.put_site_traces(traces))
+    print(handle, traces)
+    return {"handle": handle, "traces": traces}
+
+def _started_site_traces(handle: str) -> Optional[list[dict]]:
+
+    # Sites whose trace could not be started have no trace_id to aggregate
+    try:
+        traces = trace_store.site_traces(int(str(handle).split("sites-")[-1]))
+    except ValueError:
+        traces = None
+    if traces is None:
+        return None
+    return [trace for trace in traces if trace["trace_id"] != ""]
+
+@tool
+def multi_site_trace_readout(handle: str) -> dict:
     """
-    Recursively find the path to the target value in a nested dictionary or list.
+    Get the important events of every trace started by start_multi_site_trace.
 
-    Parameters:
-    - data (dict or list): The nested data structure to search.
-    - target: The value to find.
+    Args:
+        handle (str): Handle returned by start_multi_site_trace.
 
     Returns:
-    - list: A list of keys and indices representing the path to the target value.
+        events (dict): "events_exist" is True when any site reported events, "events" a table of the events with the site, application, type of event and hops affected.
     """
+    return _multi_site_trace_readout(handle)
+
+def _multi_site_trace_readout(handle: str) -> dict:
+
+    traces = _started_site_traces(handle)
+    if traces is None:
+        return _unknown_handle(handle)
+    with ThreadPoolExecutor(max_workers=MULTI_SITE_WORKERS) as executor:
+        readouts = list(executor.map(lambda trace: _trace_readout(trace["trace_id"], trace["timestamp"]), traces))
+    return _aggregate_readouts(traces, readouts)
+
+async def _amulti_site_trace_readout(handle: str) -> dict:
+
+    traces = _started_site_traces(handle)
+    if traces is None:
+        return _unknown_handle(handle)
+    semaphore = asyncio.Semaphore(MULTI_SITE_WORKERS)
+
+    async def readout(trace):
+        async with semaphore:
+            return await _atrace_readout(trace["trace_id"], trace["timestamp"])
 
-    if isinstance(data, dict):
-        for key, value in data.items():
-            if isinstance(value, list) or isinstance(value, dict):
-                # Recursively search for the target in nested structures
-                path = find_value_path(value, target)
-                if path is not None:
-                    return [key] + path
-            elif value == target:
-                return [key]
-    elif isinstance(data, list):
-        for index, item in enumerate(data):
-            if isinstance(item, dict) or isinstance(item, list):
-                # Recursively search for the target in nested structures
-                path = find_value_path(item, target)
-                if path is not None:
-                    return [index] + path
-            elif item == target:
-                return [index]
-    return None
-
-
-def get_feature_detail(json_data, direction, feature_name):
-    if json_data["type"] == "feature-of-packet":
-        for feature in json_data["data"]["packet"]['packet'][direction]:
-            if feature['feature_name'] == feature_name:
-                return feature['feature_detail']
-    return
-
-def get_features_summary(json_data, direction):
-    if json_data["type"] == "feature-of-packet":
-        features = []
-        for feature in json_data["data"]["packet"]['packet'][direction]:
-            features.append(feature["feature_name"])
-        return features
-    return
-
-def replace_invalid_color(event, color_side):
-    if event["data"]["event_direction"] == "upstream" and event["data"]["local_color"] == "INVALID" and event["data"]["remote_color"] == "INVALID":
-        if color_side == "local_color":
-            return "Service LAN"
-        if color_side  == "remote_color":
-            return "N/A"
-    if event["data"]["event_direction"] == "downstream" and event["data"]["local_color"] == "INVALID" and event["data"]["remote_color"] == "INVALID":
-        if color_side == "local_color":
-            return "N/A"
-        if color_side  == "remote_color":
-            return "Service LAN"
-    return event["data"][color_side]
+    readouts = await asyncio.gather(*(readout(trace) for trace in traces))
+    return _aggregate_readouts(traces, readouts)
+
+multi_site_trace_readout.coroutine = _amulti_site_trace_readout
+
+def _aggregate_readouts(traces: list[dict], readouts: list) -> dict:
+
+    events_exist = False
+    rows = []
+    columns = ["site"] + to_table([], EventRecord)["columns"]
+    for trace, (site_events_exist, events) in zip(traces, readouts):
+        events_exist = events_exist or site_events_exist
+        rows.extend([trace["site"]] + row for row in events["rows"])
+    return {"events_exist": events_exist, "events": {"columns": columns, "rows": rows}}
+
+@tool
+def get_multi_site_flow_summary(handle: str, application: Optional[str] = "", src_prefix: Optional[str] = "", dst_prefix: Optional[str] = "", protocol: Optional[str] = "", with_events: bool = False, top_n: int = FLOW_SUMMARY_TOP_N) -> dict:
+    """
+    Get the flows captured by every trace started by start_multi_site_trace. The optional filters work as in get_flow_summary.
+
+    Args:
+        handle (str): Handle returned by start_multi_site_trace.
+        application (str): Optional - Application name of the flows, as reported by vManage.
+        src_prefix (str): Optional - Source host or subnet of the flows.
+        dst_prefix (str): Optional - Destination host or subnet of the flows.
+        protocol (str): Optional - Protocol of the flows, e.g. TCP or UDP.
+        with_events (bool): Optional - Only return flows of applications with events.
+        top_n (int): Optional - Maximum number of flows to return per site.
+
+    Returns:
+       flow_summary (dict): "sites" lists the trace_id, timestamp and flows_matched of each site, "flows" a table of the top flows of all sites with their site. Use the timestamp of the site with get_flow_details.
+    """
+    return _get_multi_site_flow_summary(handle, application, src_prefix, dst_prefix, protocol, with_events, top_n)
+
+def _get_multi_site_flow_summary(handle: str, application: Optional[str] = "", src_prefix: Optional[str] = "", dst_prefix: Optional[str] = "", protocol: Optional[str] = "", with_events: bool = False, top_n: int = FLOW_SUMMARY_TOP_N) -> dict:
+
+    traces = _started_site_traces(handle)
+    if traces is None:
+        return _unknown_handle(handle)
+
+    def summary(trace):
+        return _get_flow_summary(trace["trace_id"], trace["timestamp"], 0, 0, application, src_prefix, dst_prefix, protocol, with_events, top_n)
+
+    with ThreadPoolExecutor(max_workers=MULTI_SITE_WORKERS) as executor:
+        summaries = list(executor.map(summary, traces))
+    return _aggregate_flow_summaries(traces, summaries)
+
+async def _aget_multi_site_flow_summary(handle: str, application: Optional[str] = "", src_prefix: Optional[str] = "", dst_prefix: Optional[str] = "", protocol: Optional[str] = "", with_events: bool = False, top_n: int = FLOW_SUMMARY_TOP_N) -> dict:
+
+    traces = _started_site_traces(handle)
+    if traces is None:
+        return _unknown_handle(handle)
+    semaphore = asyncio.Semaphore(MULTI_SITE_WORKERS)
+
+    async def summary(trace):
+        async with semaphore:
+            return await _aget_flow_summary(trace["trace_id"], trace["timestamp"], 0, 0, application, src_prefix, dst_prefix, protocol, with_events, top_n)
+
+    summaries = await asyncio.gather(*(summary(trace) for trace in traces))
+    return _aggregate_flow_summaries(traces, summaries)
+
+get_multi_site_flow_summary.coroutine = _aget_multi_site_flow_summary
+
+def _aggregate_flow_summaries(traces: list[dict], summaries: list[dict]) -> dict:
+
+    sites = []
+    rows = []
+    columns = ["site"] + to_table([], FlowRecord)["columns"]
+    for trace, flow_summary in zip(traces, summaries):
+        sites.append({
+            "site": trace["site"],
+            "trace_id": trace["trace_id"],
+            "timestamp": trace["timestamp"],
+            "flows_matched": flow_summary["flows_matched"],
+        })
+        rows.extend([trace["site"]] + row for row in flow_summary["flows"]["rows"])
+    return {"sites": sites, "flows": {"columns": columns, "rows": rows}}
+
+def _unknown_handle(handle: str) -> dict:
+
+    print("Unknown multi-site trace handle:", handle)
+    return {"error": "Unknown handle %s, start the traces with start_multi_site_trace."%(handle)}
 
 def calculate_times(epoch_ms):
     # Convert the epoch time from milliseconds to seconds for compatibility
@@ -697,15 +1014,106 @@ def calculate_times(epoch_ms):
     return epoch_plus_1_minute_ms, epoch_plus_1_hour_ms
 
 @tool
-def tracer_wait():
+def tracer_wait(trace_id: int, timestamp: int) -> dict:
     """
-    This is a function to sleep for 90 seconds. Useful when we are waiting for flows to be captured. 
+    Wait until the trace has captured flows or reported events, up to a few minutes. Useful when we are waiting for flows to be captured. 
+
+    Args:
+        trace_id (int): Trace ID returned by "start_trace".
+        timestamp (int): Start time returned by "start_trace".
+
+    Returns:
+        wait_result (dict): "ready" is True when flows or events were found, "waited_seconds" is how long the wait took.
     """
-    return time.sleep(60)
+    return _tracer_wait(trace_id, timestamp)
+
+def _tracer_wait(trace_id: int, timestamp: int) -> dict:
+
+    started = time.monotonic()
+    deadline = started + TRACE_READY_MAX_WAIT
+    delay = TRACE_READY_FIRST_POLL
+    while True:
+        trace = trace_history.lookup(trace_id)
+        flows_captured = _trace_has_flows(trace_id, timestamp)
+        # Checked even when flows were captured, the result reports both
+        events_detected = _trace_readout(trace_id, timestamp)[0]
+        if flows_captured or events_detected or (trace is not None and is_final(trace)):
+            break
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        time.sleep(min(delay, remaining))
+        delay = min(delay * TRACE_READY_BACKOFF, TRACE_READY_MAX_POLL)
+
+    return _tracer_wait_result(started, trace, flows_captured, events_detected)
+
+async def _atracer_wait(trace_id: int, timestamp: int) -> dict:
+
+    started = time.monotonic()
+    deadline = started + TRACE_READY_MAX_WAIT
+    delay = TRACE_READY_FIRST_POLL
+    while True:
+        trace = await trace_history.alookup(trace_id)
+        flows_captured = await _atrace_has_flows(trace_id, timestamp)
+        # Checked even when flows were captured, the result reports both
+        events_detected = (await _atrace_readout(trace_id, timestamp))[0]
+        if flows_captured or events_detected or (trace is not None and is_final(trace)):
+            break
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * TRACE_READY_BACKOFF, TRACE_READY_MAX_POLL)
+
+    return _tracer_wait_result(started, trace, flows_captured, events_detected)
+
+tracer_wait.coroutine = _atracer_wait
+
+def _tracer_wait_result(started: float, trace: Optional[dict], flows_captured: bool, events_detected: bool) -> dict:
+
+    wait_result = {
+        "ready": flows_captured or events_detected,
+        "flows_captured": flows_captured,
+        "events_detected": events_detected,
+        "state": trace_state(trace) if trace is not None else "",
+        "waited_seconds": round(time.monotonic() - started, 1),
+    }
+    print(wait_result, "tracer wait")
+    return wait_result
+
+def _trace_has_flows(trace_id: int, timestamp: int) -> bool:
+
+    api = "/stream/device/nwpi/traceFinFlowWithQuery?traceId=%s&timestamp=%s"%(trace_id,timestamp)
+    payload = _flow_summary_payload(timestamp)
+
+    # Stop reading at the first flow, the readiness check does not need the rest
+    with vmanage.stream("GET", api, data=payload) as response:
+        if response.status_code != 200:
+            return False
+        for _ in iter_json_items(response.iter_content(STREAM_CHUNK_SIZE), "data.item"):
+            return True
+    return False
+
+async def _atrace_has_flows(trace_id: int, timestamp: int) -> bool:
+
+    api = "/stream/device/nwpi/traceFinFlowWithQuery?traceId=%s&timestamp=%s"%(trace_id,timestamp)
+    payload = _flow_summary_payload(timestamp)
+
+    async with avmanage.stream("GET", api, content=payload) as response:
+        if response.status_code != 200:
+            return False
+        async for _ in aiter_json_items(response.aiter_bytes(STREAM_CHUNK_SIZE), "data.item"):
+            return True
+    return False
 
 @tool
 def reviewer_wait():
     """
     This is a function to sleep for 5 seconds. Useful when we are waiting for flows to be captured. 
     """
-    return time.sleep(5)
\ No newline at end of file
+    return time.sleep(5)
+
+async def _areviewer_wait():
+    return await asyncio.sleep(5)
+
+reviewer_wait.coroutine = _areviewer_wait
@@ -0,0 +1,85 @@
+"""
+This module provides the compact records returned by the NWPI tools and their tabular encoding.
+
+Flows, hops and events are kept as slotted dataclasses instead of dicts with
+display keys, and `to_table` writes a list of records as one header row
+followed by value rows. The field names are written once per table instead
+of once per record, which keeps tool output small in the LLM context.
+"""
+from dataclasses import dataclass, fields
+from typing import Optional
+
+
+@dataclass(slots=True)
+class FlowRecord:
+    """
+    One flow of a trace, as listed by get_flow_summary.
+    """
+
+    flow_id: int
+    device_trace_id: int
+    src_ip: str
+    dst_ip: str
+    app_name: str
+    protocol: str
+
+    @classmethod
+    def from_flow(cls, flow: dict) -> "FlowRecord":
+        """
+        Build the record from the "data" dict of a traceFinFlowWithQuery item.
+        """
+        return cls(
+            flow["flow_id"],
+            flow["device_trace_id"],
+            flow["src_ip"],
+            flow["dst_ip"],
+            flow["app_name"],
+            flow["protocol"],
+        )
+
+
+@dataclass(slots=True)
+class HopRecord:
+    """
+    One hop of a flow, as listed by get_flow_detail.
+    """
+
+    hop: str
+    event: Optional[str]
+    local_color: Optional[str]
+    remote_color: Optional[str]
+    ingress_intf: Optional[str]
+    egress_intf: Optional[str]
+    ingress_features: Optional[list]
+    egress_features: Optional[list]
+    fwd_decision: Optional[str]
+
+
+@dataclass(slots=True)
+class EventRecord:
+    """
+    One event of the trace readout with the hops it affected.
+    """
+
+    application: str
+    event: str
+    hops: list
+
+
+def to_table(records: list, record_type: type) -> dict:
+    """
+    Encode records of one type as a header-once table.
+
+    :param records: Records to encode, all instances of record_type.
+    :param record_type: Record dataclass, gives the columns also when there are no records.
+    :return: {"columns": [field names], "rows": [[values], ...]}.
+    """
+    columns = [field.name for field in fields(record_type)]
+    return {
+        "columns": columns,
+        "rows": [[getattr(record, column) for column in columns] for record in records],
+    }
+
+
+def table_is_empty(table: dict) -> bool:
+    return len(table["rows"]) == 0
@@ -0,0 +1,214 @@
+"""
+This module limits what one chat request can spend: supervisor rounds, tool calls, tokens and wall-clock time.
+
+A RequestBudget travels in the graph config, as a callback that counts the LLM
+calls, tokens and tool calls of every node, and under configurable["budget"]
+so the nodes can check it. When a limit is reached the supervisor finishes the
+conversation and a worker in the middle of its loop stops at its next LLM or
+tool call, so the request ends with the best partial answer instead of looping
+until the recursion limit. The usage of every request is logged and aggregated
+for /metrics.
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from typing import Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger(__name__)
+
+MAX_SUPERVISOR_ROUNDS = int(os.getenv("MAX_SUPERVISOR_ROUNDS", "8"))
+MAX_TOOL_CALLS = int(os.getenv("MAX_TOOL_CALLS", "40"))
+MAX_REQUEST_TOKENS = int(os.getenv("MAX_REQUEST_TOKENS", "100000"))
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "300"))
+PARTIAL_RESULT_CHARS = 1000
+
+
+class BudgetExceeded(Exception):
+    """
+    Raised at the next LLM or tool call once the budget of the request is used up.
+    """
+
+    def __init__(self, reason: str):
+        super().__init__("Request budget exhausted: %s" % reason)
+        self.reason = reason
+
+
+class RequestBudget(BaseCallbackHandler):
+    """
+    This class counts the usage of one request and stops it when a limit is reached.
+    """
+
+    # Exceptions of the callback must stop the run, and the count must happen before the call
+    raise_error = True
+    run_inline = True
+
+    def __init__(
+        self,
+        max_rounds: int = MAX_SUPERVISOR_ROUNDS,
+        max_tool_calls: int = MAX_TOOL_CALLS,
+        max_tokens: int = MAX_REQUEST_TOKENS,
+        deadline: float = REQUEST_DEADLINE,
+    ):
+        self.max_rounds = max_rounds
+        self.max_tool_calls = max_tool_calls
+        self.max_tokens = max_tokens
+        self.deadline = deadline
+        self.started = time.monotonic()
+        self.rounds = 0
+        self.llm_calls = 0
+        self.tool_calls = 0
+        self.tokens = 0
+        self.exhausted = None
+        self.last_results = deque(maxlen=3)
+        self._lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def _out_of(self, *limits: str) -> Optional[str]:
+        if "deadline" in limits and self.elapsed() >= self.deadline:
+            return "deadline"
+        if "tokens" in limits and self.tokens >= self.max_tokens:
+            return "tokens"
+        if "tool_calls" in limits and self.tool_calls >= self.max_tool_calls:
+            return "tool_calls"
+        if "rounds" in limits and self.rounds >= self.max_rounds:
+            return "rounds"
+        return None
+
+    def _stop(self, limit: str) -> str:
+        if self.exhausted is None:
+            self.exhausted = limit
+            logger.warning("REQUEST_BUDGET_EXHAUSTED: %s", self.describe(limit))
+        return self.describe(limit)
+
+    def describe(self, limit: str) -> str:
+        return {
+            "deadline": "deadline of %ss" % self.deadline,
+            "tokens": "%s tokens" % self.max_tokens,
+            "tool_calls": "%s tool calls" % self.max_tool_calls,
+            "rounds": "%s supervisor rounds" % self.max_rounds,
+        }[limit]
+
+    def start_round(self) -> Optional[str]:
+        """
+        Count a supervisor round, or get the reason to finish the conversation instead.
+        """
+        with self._lock:
+            limit = self._out_of("deadline", "tokens", "rounds")
+            if limit is not None:
+                return self._stop(limit)
+            self.rounds += 1
+            return None
+
+    def _before_llm(self) -> None:
+        with self._lock:
+            limit = self._out_of("deadline", "tokens")
+            if limit is not None:
+                raise BudgetExceeded(self._stop(limit))
+            self.llm_calls += 1
+
+    def on_llm_start(self, serialized, prompts, **kwargs) -> None:
+        self._before_llm()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs) -> None:
+        self._before_llm()
+
+    def on_llm_end(self, response, **kwargs) -> None:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        tokens = usage.get("total_tokens")
+        if tokens is None:
+            # Streamed answers carry the usage on the message
+            tokens = 0
+            for generations in response.generations:
+                for generation in generations:
+                    usage_metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    tokens += usage_metadata.get("total_tokens", 0)
+        with self._lock:
+            self.tokens += tokens
+
+    def on_tool_start(self, serialized, input_str, **kwargs) -> None:
+        with self._lock:
+            limit = self._out_of("deadline", "tool_calls")
+            if limit is not None:
+                raise BudgetExceeded(self._stop(limit))
+            self.tool_calls += 1
+
+    def on_tool_end(self, output, **kwargs) -> None:
+        self.last_results.append(str(getattr(output, "content", output))[:PARTIAL_RESULT_CHARS])
+
+    def partial_answer(self, reason: str) -> str:
+        """
+        Get the answer of a worker stopped by the budget, with the last tool results it got.
+        """
+        answer = "I had to stop before finishing, the request used up its budget (%s)." % reason
+        if self.last_results:
+            answer += " Last results gathered:\n" + "\n".join(self.last_results)
+        return answer
+
+    def usage(self) -> dict:
+        with self._lock:
+            return {
+                "rounds": [self.rounds, self.max_rounds],
+                "tool_calls": [self.tool_calls, self.max_tool_calls],
+                "tokens": [self.tokens, self.max_tokens],
+                "llm_calls": self.llm_calls,
+                "seconds": [round(self.elapsed(), 1), self.deadline],
+                "exhausted": self.exhausted,
+            }
+
+
+def budget_of(config: Optional[dict]) -> Optional[RequestBudget]:
+    return (config or {}).get("configurable", {}).get("budget")
+
+
+def with_budget(config: dict, budget: RequestBudget) -> dict:
+    """
+    Add the budget to a graph config, with a recursion limit that leaves room for all its rounds.
+    """
+    return {
+        **config,
+        "configurable": {**config.get("configurable", {}), "budget": budget},
+        "callbacks": list(config.get("callbacks") or []) + [budget],
+        "recursion_limit": 2 * budget.max_rounds + 5,
+    }
+
+
+class BudgetStats:
+    """
+    This class aggregates the budget usage of the requests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tokens = 0
+        self.tool_calls = 0
+        self.exhausted = Counter()
+
+    def record(self, budget: RequestBudget) -> dict:
+        usage = budget.usage()
+        logger.info("REQUEST_BUDGET_USAGE: %s", usage)
+        with self._lock:
+            self.requests += 1
+            self.tokens += budget.tokens
+            self.tool_calls += budget.tool_calls
+            if budget.exhausted is not None:
+                self.exhausted[budget.exhausted] += 1
+        return usage
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "tokens": self.tokens,
+                "tool_calls": self.tool_calls,
+                "exhausted": dict(self.exhausted),
+            }
+
+
+budget_stats = BudgetStats()
@@ -0,0 +1,102 @@
+"""
+This module provides the conversation memory of the agents, scoped per session.
+
+Each session (a Webex room and user, or an API session id) keeps its own history
+per agent instead of one buffer shared by every user for the life of the process.
+A history is a window of the last exchanges, also bounded in characters, and
+sessions are dropped after being idle for a while or when there are too many,
+least recently used first.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+DEFAULT_SESSION = "default"
+MEMORY_WINDOW = int(os.getenv("MEMORY_WINDOW", "6"))
+MEMORY_MAX_CHARS = int(os.getenv("MEMORY_MAX_CHARS", "8000"))
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "500"))
+SESSION_IDLE_TTL = int(os.getenv("SESSION_IDLE_TTL", "1800"))
+
+
+class SessionMemoryStore:
+    """
+    This class keeps a bounded chat history per session and agent.
+    """
+
+    def __init__(
+        self,
+        window: int = MEMORY_WINDOW,
+        max_chars: int = MEMORY_MAX_CHARS,
+        max_sessions: int = MAX_SESSIONS,
+        idle_ttl: int = SESSION_IDLE_TTL,
+    ):
+        self.window = window
+        self.max_chars = max_chars
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        # session_id -> (last_used, {agent: deque of (input, output)})
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _evict(self, now: float) -> None:
+        # Sessions are ordered by last use, the idle ones are at the front
+        while self._sessions:
+            session_id, (last_used, _) = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - last_used < self.idle_ttl:
+                break
+            del self._sessions[session_id]
+            self.evictions += 1
+
+    def history(self, session_id: str, agent: str) -> list:
+        """
+        Get the chat history of an agent in a session, as alternating human and AI messages.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                return []
+            self._sessions[session_id] = (now, session[1])
+            self._sessions.move_to_end(session_id)
+            exchanges = list(session[1].get(agent, ()))
+        messages = []
+        for user_input, output in exchanges:
+            messages.append(HumanMessage(content=user_input))
+            messages.append(AIMessage(content=output))
+        return messages
+
+    def append(self, session_id: str, agent: str, user_input: str, output: str) -> None:
+        """
+        Add an exchange to the history, dropping the oldest ones beyond the window or the character bound.
+        """
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            agents = session[1] if session is not None else {}
+            exchanges = agents.setdefault(agent, deque(maxlen=self.window))
+            exchanges.append((user_input, output))
+            while len(exchanges) > 1 and sum(len(i) + len(o) for i, o in exchanges) > self.max_chars:
+                exchanges.popleft()
+            self._sessions[session_id] = (now, agents)
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "exchanges": sum(len(e) for _, agents in self._sessions.values() for e in agents.values()),
+                "evictions": self.evictions,
+            }
+
+
+session_memory = SessionMemoryStore()
@@ -0,0 +1,45 @@
+"""
+This module measures how long the app takes to start, broken down by phase.
+
+Import it before anything else so the clock starts with the app, then wrap
+each initialization step in `startup_timer.phase(name)`. The report is logged
+once the app is ready and returned under "startup" by /metrics.
+"""
+import contextlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """
+    This class records the duration of each startup phase.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.perf_counter() - start, 3)
+
+    def mark(self, name: str, since: float) -> None:
+        """
+        Record a phase that started at `since`, a time.perf_counter() value.
+        """
+        self.phases[name] = round(time.perf_counter() - since, 3)
+
+    def report(self) -> dict:
+        return {"phases": dict(self.phases), "total": round(sum(self.phases.values()), 3)}
+
+    def log(self) -> None:
+        logger.info("STARTUP_TIMING: %s", self.report())
+
+
+startup_timer = StartupTimer()
@@ -0,0 +1,152 @@
+"""
+This module decides the deterministic supervisor transitions in code instead of asking the LLM.
+
+Most conversations follow the same path: the user message goes to the Tracer, the
+Tracer reports to the Reviewer, and the Reviewer answer is final. Those
+transitions are decided by rules, and the LLM supervisor chain is only called for
+the states the rules cannot decide, e.g. when the Reviewer asks the Tracer a
+question. Set SUPERVISOR_ROUTING=llm to always use the LLM supervisor.
+
+The LLM supervisor sees a bounded view of the conversation: the first user
+message and the last SUPERVISOR_HISTORY messages, so its prompt does not grow
+with long conversations.
+"""
+import logging
+import os
+import threading
+from typing import Optional
+
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableLambda
+
+from request_budget import BudgetExceeded, budget_of
+
+logger = logging.getLogger(__name__)
+
+ROUTING_MODE = os.getenv("SUPERVISOR_ROUTING", "rules")
+SUPERVISOR_HISTORY = int(os.getenv("SUPERVISOR_HISTORY", "8"))
+
+
+class RouteStats:
+    """
+    This class counts the supervisor decisions taken by rules and by the LLM.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rule_routes = 0
+        self.llm_routes = 0
+
+    def record(self, by_rule: bool) -> None:
+        with self._lock:
+            if by_rule:
+                self.rule_routes += 1
+            else:
+                self.llm_routes += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            decisions = self.rule_routes + self.llm_routes
+            return {
+                "mode": ROUTING_MODE,
+                "llm_calls_avoided": self.rule_routes,
+                "llm_calls": self.llm_routes,
+                "avoided_rate": round(self.rule_routes / decisions, 3) if decisions else 0.0,
+            }
+
+
+route_stats = RouteStats()
+
+
+def asks_tracer(content: str) -> bool:
+    """
+    Check if a Reviewer message asks the Tracer something, which needs another Tracer turn.
+    """
+    text = content.lower()
+    return "?" in text and "tracer" in text
+
+
+def rule_route(messages: list) -> Optional[str]:
+    """
+    Get the next worker for the deterministic states of the conversation.
+
+    :param messages: Conversation so far, the last message decides.
+    :return: "Tracer", "Reviewer" or "FINISH", or None when the LLM supervisor must decide.
+    """
+    if len(messages) == 0:
+        return None
+    last = messages[-1]
+    name = getattr(last, "name", None)
+    if name is None:
+        # A new user message always starts with the Tracer
+        return "Tracer"
+    if name == "Tracer":
+        # Nothing goes back to the user without going through the Reviewer
+        return "Reviewer"
+    if name == "Reviewer" and not asks_tracer(str(last.content)):
+        return "FINISH"
+    return None
+
+
+def supervisor_view(messages: list, max_messages: int = SUPERVISOR_HISTORY) -> list:
+    """
+    Trim the conversation for the LLM supervisor to the first message, the request, and the last max_messages.
+    """
+    if len(messages) <= max_messages + 1:
+        return list(messages)
+    return [messages[0]] + list(messages[-max_messages:])
+
+
+def finish_on_budget(state: dict, reason: str) -> dict:
+    """
+    End the conversation when the request budget is used up, the last worker answer is the best partial answer.
+    """
+    update = {"next": "FINISH"}
+    if getattr(state["input"][-1], "name", None) is None:
+        # No worker answered yet, tell the user why there is no answer
+        update["input"] = [HumanMessage(
+            content="I had to stop before finishing, the request used up its budget (%s)." % reason,
+            name="supervisor",
+        )]
+    return update
+
+
+def create_supervisor_node(supervisor_chain, mode: str = ROUTING_MODE) -> RunnableLambda:
+    """
+    Wrap the LLM supervisor chain so deterministic transitions skip it.
+
+    :param supervisor_chain: Runnable returning {"next": worker} for the state.
+    :param mode: "rules" to route by rules first, "llm" to always call the chain.
+    """
+
+    def route(state: dict, config: dict) -> dict:
+        budget = budget_of(config)
+        reason = budget.start_round() if budget is not None else None
+        if reason is not None:
+            return finish_on_budget(state, reason)
+        next_worker = rule_route(state["input"]) if mode == "rules" else None
+        route_stats.record(next_worker is not None)
+        if next_worker is not None:
+            logger.info("SUPERVISOR_RULE_ROUTE: %s", next_worker)
+            return {"next": next_worker}
+        try:
+            return supervisor_chain.invoke({**state, "input": supervisor_view(state["input"])})
+        except BudgetExceeded as e:
+            return finish_on_budget(state, e.reason)
+
+    async def aroute(state: dict, config: dict) -> dict:
+        budget = budget_of(config)
+        reason = budget.start_round() if budget is not None else None
+        if reason is not None:
+            return finish_on_budget(state, reason)
+        next_worker = rule_route(state["input"]) if mode == "rules" else None
+        route_stats.record(next_worker is not None)
+        if next_worker is not None:
+            logger.info("SUPERVISOR_RULE_ROUTE: %s", next_worker)
+            return {"next": next_worker}
+        try:
+            return await supervisor_chain.ainvoke({**state, "input": supervisor_view(state["input"])})
+        except BudgetExceeded as e:
+            return finish_on_budget(state, e.reason)
+
+    return RunnableLambda(route, afunc=aroute)
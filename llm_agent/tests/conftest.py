@@ -0,0 +1,17 @@
+"""
+Test setup: the modules of the assistant import each other by their top-level names,
+and importing them must not reach vManage, OpenAI or the log file of the app.
+"""
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("TRACE_STORE_PATH", ":memory:")
+os.environ.setdefault("TOOL_SCHEMA_CACHE", "")
+
+import logging_config.main  # noqa: E402
+
+# The app logging config writes to a path relative to the repository parent
+logging_config.main.setup_logging = lambda: logging.getLogger("llm_agent")
@@ -0,0 +1,70 @@
+"""
+The agent state must grow by one message per node, not by the whole history.
+"""
+import itertools
+
+import pytest
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableLambda
+
+import llm_agent
+from supervisor_routing import SUPERVISOR_HISTORY, supervisor_view
+
+
+class StubExecutor:
+    """
+    Stands in for an agent executor, the Reviewer asks the Tracer again until the last turn.
+    """
+
+    def __init__(self, name: str, turns: int):
+        self.name = name
+        self.turns = turns
+        self.calls = 0
+
+    def invoke(self, inputs: dict) -> dict:
+        self.calls += 1
+        if self.name == "Reviewer" and self.calls < self.turns:
+            return {"output": "Tracer, can you check the other flows?"}
+        return {"output": "%s answer %s" % (self.name, self.calls)}
+
+    async def ainvoke(self, inputs: dict) -> dict:
+        return self.invoke(inputs)
+
+
+def build_graph(monkeypatch, turns: int, seen: list):
+    names = itertools.cycle(["Tracer", "Reviewer"])
+    monkeypatch.setattr(llm_agent, "create_agent", lambda llm, tools, prompt: StubExecutor(next(names), turns))
+
+    def supervisor(state: dict) -> dict:
+        seen.append(len(state["input"]))
+        return {"next": "Tracer"}
+
+    monkeypatch.setattr(llm_agent, "supervisor_chain", RunnableLambda(supervisor))
+    return llm_agent.create_agent_graph()
+
+
+@pytest.mark.parametrize("turns", [1, 3, 10])
+def test_state_grows_linearly_with_turns(monkeypatch, turns):
+    seen = []
+    graph = build_graph(monkeypatch, turns, seen)
+
+    state = graph.invoke(
+        {"input": [HumanMessage(content="trace site 100")]},
+        config={"configurable": {"session_id": "test-%s" % turns}, "recursion_limit": 100},
+    )
+
+    assert len(state["input"]) == 1 + 2 * turns
+    assert [message.name for message in state["input"][1:]] == ["Tracer", "Reviewer"] * turns
+    # The LLM supervisor only sees a bounded view of the conversation
+    assert all(size <= SUPERVISOR_HISTORY + 1 for size in seen)
+
+
+def test_supervisor_view_is_bounded():
+    messages = [HumanMessage(content=str(index)) for index in range(50)]
+
+    view = supervisor_view(messages, max_messages=8)
+
+    assert len(view) == 9
+    assert view[0] is messages[0]
+    assert view[1:] == messages[-8:]
+    assert supervisor_view(messages[:5], max_messages=8) == messages[:5]
@@ -0,0 +1,97 @@
+"""
+An interrupted run is resumed before the next message of its thread, and finished runs leave no checkpoints.
+"""
+import asyncio
+
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableLambda
+
+import llm_agent
+from checkpoints import close_run, open_checkpointer, resume_pending, start_run, thread_config, thread_lock
+
+
+class FlakyExecutor:
+    """
+    Answers with its input, failing the first `failures` calls.
+    """
+
+    def __init__(self, name: str, failures: int = 0):
+        self.name = name
+        self.failures = failures
+
+    def invoke(self, inputs: dict) -> dict:
+        if self.failures:
+            self.failures -= 1
+            raise TimeoutError("vManage did not answer")
+        return {"output": "%s: %s" % (self.name, inputs["input"])}
+
+    async def ainvoke(self, inputs: dict) -> dict:
+        return self.invoke(inputs)
+
+
+async def checkpoint_rows(graph) -> int:
+    async with graph.checkpointer.conn.execute("SELECT COUNT(*) FROM checkpoints") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+def build_chat(monkeypatch, reviewer_failures: int):
+    executors = iter([FlakyExecutor("Tracer"), FlakyExecutor("Reviewer", failures=reviewer_failures)])
+    monkeypatch.setattr(llm_agent, "create_agent", lambda llm, tools, prompt: next(executors))
+    monkeypatch.setattr(llm_agent, "supervisor_chain", RunnableLambda(lambda state: {"next": "FINISH"}))
+    graph = llm_agent.create_agent_graph()
+    config = thread_config("webex:room:user", "webex:room:user")
+
+    async def chat(text: str):
+        async with thread_lock(config):
+            resumed = await resume_pending(graph, config)
+            await start_run(graph, config)
+            try:
+                result = await graph.ainvoke({"input": [HumanMessage(content=text)]}, config=config)
+            finally:
+                await close_run(graph, config)
+        return resumed, result["input"][-1].content
+
+    return graph, config, chat
+
+
+def test_interrupted_run_is_resumed_before_the_new_message(monkeypatch, tmp_path):
+    graph, config, chat = build_chat(monkeypatch, reviewer_failures=1)
+
+    async def scenario():
+        graph.checkpointer = open_checkpointer(str(tmp_path / "checkpoints.db"))
+        try:
+            try:
+                await chat("trace site 100")
+            except TimeoutError:
+                pass
+            assert await checkpoint_rows(graph) > 0
+            resumed, answer = await chat("what about site 200?")
+            assert resumed == "Reviewer: Tracer: trace site 100"
+            assert answer == "Reviewer: Tracer: what about site 200?"
+            # Finished runs are deleted, the thread does not grow with the conversation
+            assert await checkpoint_rows(graph) == 0
+            assert await resume_pending(graph, config) is None
+        finally:
+            await graph.checkpointer.conn.close()
+
+    asyncio.run(scenario())
+
+
+def test_run_failing_again_on_resume_does_not_block_the_thread(monkeypatch, tmp_path):
+    graph, config, chat = build_chat(monkeypatch, reviewer_failures=2)
+
+    async def scenario():
+        graph.checkpointer = open_checkpointer(str(tmp_path / "checkpoints.db"))
+        try:
+            try:
+                await chat("trace site 100")
+            except TimeoutError:
+                pass
+            resumed, answer = await chat("what about site 200?")
+            assert resumed is None
+            assert answer == "Reviewer: Tracer: what about site 200?"
+            assert await checkpoint_rows(graph) == 0
+        finally:
+            await graph.checkpointer.conn.close()
+
+    asyncio.run(scenario())
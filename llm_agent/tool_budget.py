@@ -0,0 +1,219 @@
+"""
+This module bounds the size of tool results and agent prompts in tokens.
+
+A tool result over its token budget is split into pages at row boundaries.
+The agent receives the first page with a short summary of the whole result
+and a cursor, and the remaining pages stay on the server until the agent
+asks for them with the `get_next_page` tool. The agent scratchpad is also
+bounded: once it is over budget, the oldest tool results are elided.
+"""
+import functools
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+from langchain.agents import tool
+from langchain_core.messages import FunctionMessage, ToolMessage
+from langchain_core.tools import StructuredTool
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+DEFAULT_TOOL_TOKEN_BUDGET = int(os.getenv("TOOL_TOKEN_BUDGET", "2000"))
+# Tools whose results are known to grow with the size of the trace
+TOOL_TOKEN_BUDGETS = {
+    "get_flow_summary": 3000,
+    "get_flow_detail": 3000,
+    "get_flow_details": 4000,
+}
+# Upper bound of the tool results kept in the agent scratchpad
+SCRATCHPAD_TOKEN_BUDGET = int(os.getenv("SCRATCHPAD_TOKEN_BUDGET", "12000"))
+MAX_CURSORS = 64
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the tokens of a text, about 4 characters per token for English and JSON.
+    """
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def serialize(result) -> str:
+    if isinstance(result, str):
+        return result
+    return json.dumps(result, default=str, separators=(",", ":"))
+
+
+def describe(result) -> dict:
+    """
+    Summarize the shape of a result: scalars as they are, lists and tables by their length.
+    """
+    if isinstance(result, dict):
+        if "columns" in result and "rows" in result:
+            return {"columns": result["columns"], "rows": len(result["rows"])}
+        return {key: describe(value) for key, value in result.items()}
+    if isinstance(result, (list, tuple)):
+        return "%s items" % len(result)
+    if isinstance(result, str) and len(result) > 80:
+        return "%s characters" % len(result)
+    return result
+
+
+def split_pages(text: str, page_chars: int) -> list[str]:
+    """
+    Split a text into pages of at most page_chars, cutting after a row or object when possible.
+    """
+    pages = []
+    start = 0
+    while len(text) - start > page_chars:
+        end = start + page_chars
+        cut = max(text.rfind("],", start, end), text.rfind("},", start, end))
+        # Only cut at a boundary that keeps the page at least half full
+        end = cut + 2 if cut >= start + page_chars // 2 else end
+        pages.append(text[start:end])
+        start = end
+    pages.append(text[start:])
+    return pages
+
+
+class ToolResultPager:
+    """
+    This class keeps the pages of truncated tool results behind cursors, least recently used cursors are dropped first.
+    """
+
+    def __init__(self, max_cursors: int = MAX_CURSORS):
+        self.max_cursors = max_cursors
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self.truncated = 0
+
+    def paginate(self, name: str, result, budget: int):
+        """
+        Get the result as is when it fits the budget, otherwise its first page.
+
+        :param name: Name of the tool that produced the result.
+        :param budget: Token budget of the tool.
+        :return: The result, or a dict with the first page, a summary and the cursor of the next page.
+        """
+        text = serialize(result)
+        tokens = estimate_tokens(text)
+        if tokens <= budget:
+            return result
+
+        pages = split_pages(text, budget * CHARS_PER_TOKEN)
+        cursor = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._pages[cursor] = (name, pages, tokens)
+            while len(self._pages) > self.max_cursors:
+                self._pages.popitem(last=False)
+            self.truncated += 1
+        logger.info("TOOL_RESULT_TRUNCATED: %s %s tokens in %s pages", name, tokens, len(pages))
+        return self._page(cursor, name, pages, tokens, 0, describe(result))
+
+    def next_page(self, cursor: str, page: int):
+        with self._lock:
+            if cursor not in self._pages:
+                return {"error": "Unknown or expired cursor %s, call the tool again." % cursor}
+            self._pages.move_to_end(cursor)
+            name, pages, tokens = self._pages[cursor]
+        if not 0 <= page < len(pages):
+            return {"error": "Page %s does not exist, the result has %s pages." % (page + 1, len(pages))}
+        return self._page(cursor, name, pages, tokens, page, None)
+
+    @staticmethod
+    def _page(cursor: str, name: str, pages: list[str], tokens: int, page: int, summary) -> dict:
+        answer = {
+            "truncated": True,
+            "tool": name,
+            "total_tokens": tokens,
+            "page": page + 1,
+            "pages": len(pages),
+            "content": pages[page],
+        }
+        if summary is not None:
+            answer["summary"] = summary
+        if page + 1 < len(pages):
+            answer["next_page"] = {"cursor": cursor, "page": page + 2}
+        return answer
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"cursors": len(self._pages), "truncated": self.truncated}
+
+
+tool_pages = ToolResultPager()
+
+
+@tool
+def get_next_page(cursor: str, page: int) -> dict:
+    """
+    Get another page of a tool result that was too large and was truncated.
+
+    Args:
+        cursor (str): The "cursor" of the "next_page" field of the truncated result.
+        page (int): The "page" of the "next_page" field of the truncated result.
+
+    Returns:
+        page (dict): The page content, with the cursor of the following page if there is one.
+    """
+    return tool_pages.next_page(cursor, page - 1)
+
+
+def budget_tools(tools: list, budgets: dict = None, pager: ToolResultPager = tool_pages) -> list:
+    """
+    Wrap tools so their results are paginated above their token budget, and add get_next_page.
+
+    :param budgets: Token budget per tool name, tools not listed get DEFAULT_TOOL_TOKEN_BUDGET.
+    :return: New tool list, the given tools are not modified.
+    """
+    budgets = TOOL_TOKEN_BUDGETS if budgets is None else budgets
+    budgeted = []
+    for original in tools:
+        budget = budgets.get(original.name, DEFAULT_TOOL_TOKEN_BUDGET)
+        budgeted.append(StructuredTool(
+            name=original.name,
+            description=original.description,
+            args_schema=original.args_schema,
+            func=_budget_func(original.func, original.name, budget, pager),
+            coroutine=_budget_coroutine(original.coroutine, original.name, budget, pager) if original.coroutine else None,
+        ))
+    return budgeted + [get_next_page]
+
+
+def _budget_func(func, name: str, budget: int, pager: ToolResultPager):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return pager.paginate(name, func(*args, **kwargs), budget)
+    return wrapper
+
+
+def _budget_coroutine(coroutine, name: str, budget: int, pager: ToolResultPager):
+    @functools.wraps(coroutine)
+    async def wrapper(*args, **kwargs):
+        return pager.paginate(name, await coroutine(*args, **kwargs), budget)
+    return wrapper
+
+
+def bound_scratchpad(messages: list, budget: int = SCRATCHPAD_TOKEN_BUDGET) -> list:
+    """
+    Elide the oldest tool results of a scratchpad until it fits the token budget.
+
+    The tool calls stay in place so the model still sees which tools it used.
+    """
+    total = sum(estimate_tokens(str(message.content)) for message in messages)
+    if total <= budget:
+        return messages
+    bounded = list(messages)
+    for index, message in enumerate(bounded):
+        if total <= budget:
+            break
+        if isinstance(message, (FunctionMessage, ToolMessage)):
+            tokens = estimate_tokens(str(message.content))
+            elided = "[Result elided to bound the prompt, %s tokens. Call the tool again if needed.]" % tokens
+            # A ToolMessage keeps its tool_call_id, the API rejects tool calls without a result
+            bounded[index] = message.copy(update={"content": elided})
+            total -= tokens - estimate_tokens(elided)
+    return bounded
@@ -0,0 +1,63 @@
+"""
+This module provides the agent executor that runs the tool calls of one LLM turn at the same time.
+
+With parallel tool calling the model can ask for several independent tools in
+one turn, e.g. `get_site_list` and `get_device_details_from_site`, or
+`trace_readout` and `get_flow_summary`. The stock AgentExecutor runs them one
+after the other under invoke() and all at once under ainvoke(). This executor
+runs them at most MAX_PARALLEL_TOOLS at a time in both cases. The bound is per
+turn: a conversation waiting in tracer_wait does not hold slots that other
+conversations need.
+"""
+import asyncio
+import contextvars
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from langchain.agents import AgentExecutor
+
+MAX_PARALLEL_TOOLS = int(os.getenv("MAX_PARALLEL_TOOLS", "4"))
+
+# Pool (sync) or semaphore (async) of the turn being executed
+_turn_pool = contextvars.ContextVar("turn_tool_pool", default=None)
+_turn_slots = contextvars.ContextVar("turn_tool_slots", default=None)
+
+
+class ParallelToolExecutor(AgentExecutor):
+    """
+    This class is an AgentExecutor that runs the tool calls of a turn concurrently, at most MAX_PARALLEL_TOOLS at a time.
+    """
+
+    def _iter_next_step(self, *args, **kwargs):
+        # _perform_agent_action hands back futures, the steps are yielded once all the tools of the turn are done
+        with ThreadPoolExecutor(max_workers=MAX_PARALLEL_TOOLS, thread_name_prefix="agent-tool") as pool:
+            token = _turn_pool.set(pool)
+            try:
+                pending = []
+                for step in super()._iter_next_step(*args, **kwargs):
+                    if isinstance(step, Future):
+                        pending.append(step)
+                    else:
+                        yield step
+                for future in pending:
+                    yield future.result()
+            finally:
+                _turn_pool.reset(token)
+
+    def _perform_agent_action(self, *args, **kwargs) -> Future:
+        # The context carries the callbacks and the LLM cache scope of the node into the pool thread
+        context = contextvars.copy_context()
+        return _turn_pool.get().submit(context.run, super()._perform_agent_action, *args, **kwargs)
+
+    async def _aiter_next_step(self, *args, **kwargs):
+        # The tool tasks of the turn copy the context, so they all share this semaphore
+        token = _turn_slots.set(asyncio.Semaphore(MAX_PARALLEL_TOOLS))
+        try:
+            async for step in super()._aiter_next_step(*args, **kwargs):
+                yield step
+        finally:
+            _turn_slots.reset(token)
+
+    async def _aperform_agent_action(self, *args, **kwargs):
+        async with _turn_slots.get():
+            return await super()._aperform_agent_action(*args, **kwargs)
@@ -0,0 +1,82 @@
+"""
+This module precomputes the OpenAI tool schemas of the agents and caches them between restarts.
+
+Converting a tool to its schema goes through LangChain helpers that inspect the
+call stack, which costs tens of milliseconds per tool on every start. Schemas
+are kept in memory and in a JSON file (`TOOL_SCHEMA_CACHE`, default
+tool_schemas.json next to this module), keyed by a fingerprint of the tool
+name, description and arguments, so a changed tool is converted again. Set
+TOOL_SCHEMA_CACHE to an empty string to keep them in memory only.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+logger = logging.getLogger(__name__)
+
+TOOL_SCHEMA_CACHE = os.getenv(
+    "TOOL_SCHEMA_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tool_schemas.json")
+)
+
+
+def fingerprint(tool) -> str:
+    source = json.dumps([tool.name, tool.description, tool.args], sort_keys=True, default=str)
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+class ToolSchemaCache:
+    """
+    This class maps tool fingerprints to OpenAI tool schemas, backed by an optional JSON file.
+    """
+
+    def __init__(self, path: str = TOOL_SCHEMA_CACHE):
+        self.path = path
+        self._schemas = None
+        self._lock = threading.Lock()
+        self.converted = 0
+
+    def _load(self) -> dict:
+        if self._schemas is None:
+            self._schemas = {}
+            if self.path and os.path.exists(self.path):
+                try:
+                    with open(self.path) as file:
+                        self._schemas = json.load(file)
+                except (OSError, ValueError) as e:
+                    logger.warning("TOOL_SCHEMA_CACHE_UNREADABLE: %s", e)
+        return self._schemas
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        try:
+            with open(self.path, "w") as file:
+                json.dump(self._schemas, file)
+        except OSError as e:
+            logger.warning("TOOL_SCHEMA_CACHE_NOT_SAVED: %s", e)
+
+    def schemas(self, tools: list) -> list[dict]:
+        """
+        Get the OpenAI tool schemas of the tools, converting only the ones not cached.
+        """
+        with self._lock:
+            cached = self._load()
+            result = []
+            missing = False
+            for tool in tools:
+                key = fingerprint(tool)
+                if key not in cached:
+                    cached[key] = convert_to_openai_tool(tool)
+                    self.converted += 1
+                    missing = True
+                result.append(cached[key])
+            if missing:
+                self._save()
+            return result
+
+
+tool_schemas = ToolSchemaCache()
@@ -0,0 +1,119 @@
+"""
+This module provides an in-memory index of the NWPI trace history keyed by trace-id.
+
+The index answers trace lookups from a dictionary instead of downloading and
+scanning the whole `nwpi/traceHistory` list on every call. A refresh only asks
+vManage for entries newer than the oldest trace that can still change, which is
+the newest known `entry_time` unless some indexed trace has not stopped yet.
+Refreshes are single-flight: lookups that miss while a refresh is in progress
+wait for it instead of downloading the history again.
+"""
+import asyncio
+import threading
+import time
+import weakref
+
+TRACE_HISTORY_API = "/stream/device/nwpi/traceHistory"
+SINCE_PARAM = "startTime"
+MIN_REFRESH_INTERVAL = 2
+FINAL_STATES = {"stopped"}
+
+
+def trace_state(trace: dict) -> str:
+    return trace.get("data", {}).get("summary", {}).get("state", "")
+
+
+def is_final(trace: dict) -> bool:
+    """
+    Check if a trace entry can no longer change.
+    """
+    return trace_state(trace).lower() in FINAL_STATES
+
+
+class TraceHistoryIndex:
+    """
+    This class keeps the traceHistory entries seen so far and refreshes them incrementally.
+    """
+
+    def __init__(self, client, async_client=None):
+        self.client = client
+        self.async_client = async_client
+        self._traces = {}
+        self._last_entry_time = 0
+        self._last_refresh = 0.0
+        self._refreshes = 0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        # One asyncio lock per event loop, they cannot be shared between loops
+        self._arefresh_locks = weakref.WeakKeyDictionary()
+
+    def _since(self) -> int:
+        """
+        Get the entry_time from which vManage must send entries again.
+        """
+        with self._lock:
+            pending = [trace["entry_time"] for trace in self._traces.values() if not is_final(trace)]
+            return min(pending + [self._last_entry_time])
+
+    def _merge(self, response) -> None:
+        if response.status_code != 200:
+            print("Error:", response.status_code)
+            return
+        with self._lock:
+            for trace in response.json().get("data", []):
+                self._traces[trace["trace-id"]] = trace
+                self._last_entry_time = max(self._last_entry_time, trace.get("entry_time", 0))
+            self._last_refresh = time.monotonic()
+            self._refreshes += 1
+
+    def _needs_refresh(self, trace_id: int) -> bool:
+        trace = self._traces.get(trace_id)
+        if trace is None:
+            return True
+        if is_final(trace):
+            return False
+        # Running traces are refreshed at most every MIN_REFRESH_INTERVAL seconds
+        return time.monotonic() - self._last_refresh >= MIN_REFRESH_INTERVAL
+
+    def _params(self) -> dict:
+        since = self._since()
+        return {SINCE_PARAM: since} if since else {}
+
+    def refresh(self) -> None:
+        self._merge(self.client.get(TRACE_HISTORY_API, params=self._params()))
+
+    async def arefresh(self) -> None:
+        self._merge(await self.async_client.get(TRACE_HISTORY_API, params=self._params()))
+
+    def _refresh_once(self) -> None:
+        seen = self._refreshes
+        with self._refresh_lock:
+            # A refresh finished while this one waited, its result is as fresh as ours would be
+            if self._refreshes == seen:
+                self.refresh()
+
+    async def _arefresh_once(self) -> None:
+        loop = asyncio.get_running_loop()
+        lock = self._arefresh_locks.get(loop)
+        if lock is None:
+            lock = self._arefresh_locks[loop] = asyncio.Lock()
+        seen = self._refreshes
+        async with lock:
+            if self._refreshes == seen:
+                await self.arefresh()
+
+    def lookup(self, trace_id: int):
+        """
+        Get the traceHistory entry of a trace, refreshing first if it is unknown or still running.
+
+        :param trace_id: Trace ID to look up.
+        :return: The traceHistory entry, or None if vManage does not know the trace.
+        """
+        if self._needs_refresh(trace_id):
+            self._refresh_once()
+        return self._traces.get(trace_id)
+
+    async def alookup(self, trace_id: int):
+        if self._needs_refresh(trace_id):
+            await self._arefresh_once()
+        return self._traces.get(trace_id)
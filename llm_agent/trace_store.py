@@ -0,0 +1,251 @@
+"""
+This module provides a persistent local store for the results of stopped NWPI traces.
+
+Once a trace has stopped, its readout, flow summary and flow details never
+change, so the NWPI tools keep them in a SQLite file keyed by kind, trace-id,
+entry_time and a per-kind key (e.g. the flow-id). Follow-up questions about
+the same trace are answered from the file, also after a restart. The traces
+started by a multi-site trace are kept there too, for a day, under their handle. The file is
+kept under a size bound by evicting the least recently read results first,
+along with the device traces of the traces that have no results left.
+
+Usage:
+    python trace_store.py stats
+    python trace_store.py list [limit]
+    python trace_store.py purge [trace_id]
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "trace_results.db")
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# Multi-site trace handles are kept for a day, and only the most recent ones
+SITE_TRACES_TTL = 86400
+MAX_SITE_TRACES = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    kind TEXT NOT NULL,
+    trace_id INTEGER NOT NULL,
+    entry_time INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (kind, trace_id, entry_time, key)
+);
+CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed);
+CREATE TABLE IF NOT EXISTS device_traces (
+    device_trace_id INTEGER NOT NULL,
+    entry_time INTEGER NOT NULL,
+    trace_id INTEGER NOT NULL,
+    PRIMARY KEY (device_trace_id, entry_time)
+);
+CREATE TABLE IF NOT EXISTS site_traces (
+    handle INTEGER PRIMARY KEY AUTOINCREMENT,
+    traces TEXT NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+
+class TraceResultStore:
+    """
+    This class is a thread-safe SQLite store of JSON tool results with size-based retention.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # The file is only created on first use, always under self._lock
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def get(self, kind: str, trace_id: int, entry_time: int, key: str = ""):
+        """
+        Get a stored result and mark it as recently read.
+
+        :return: The decoded result, or None if it is not stored.
+        """
+        where = (kind, trace_id, entry_time, str(key))
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM results WHERE kind=? AND trace_id=? AND entry_time=? AND key=?", where
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute(
+                "UPDATE results SET accessed=? WHERE kind=? AND trace_id=? AND entry_time=? AND key=?",
+                (time.time(),) + where,
+            )
+        return json.loads(row[0])
+
+    def put(self, kind: str, trace_id: int, entry_time: int, key: str, value) -> None:
+        """
+        Store a result, then evict the least recently read ones above the size bound.
+        """
+        encoded = json.dumps(value)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind, trace_id, entry_time, str(key), encoded, len(encoded), time.time()),
+            )
+            self._enforce_size()
+
+    def _enforce_size(self) -> None:
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute("SELECT rowid, size FROM results ORDER BY accessed").fetchall()
+        evicted = []
+        for rowid, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((rowid,))
+            total -= size
+        self._db.executemany("DELETE FROM results WHERE rowid=?", evicted)
+        self.evictions += len(evicted)
+        # Device traces only serve to key results, the ones of traces without results left go too
+        self._db.execute(
+            "DELETE FROM device_traces WHERE NOT EXISTS (SELECT 1 FROM results "
+            "WHERE results.trace_id=device_traces.trace_id AND results.entry_time=device_traces.entry_time)"
+        )
+
+    def remember_device_trace(self, device_trace_id: int, entry_time: int, trace_id: int) -> None:
+        """
+        Record which trace a device trace belongs to, flowDetail only knows the device trace.
+        """
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO device_traces VALUES (?, ?, ?)",
+                (device_trace_id, entry_time, trace_id),
+            )
+
+    def trace_of_device(self, device_trace_id: int, entry_time: int):
+        """
+        Get the trace-id a device trace belongs to, or None if no flow summary recorded it.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT trace_id FROM device_traces WHERE device_trace_id=? AND entry_time=?",
+                (device_trace_id, entry_time),
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def put_site_traces(self, traces: list) -> int:
+        """
+        Store the traces started by one multi-site trace, then drop the expired and the oldest handles.
+
+        :return: Number of the handle, never reused.
+        """
+        now = time.time()
+        with self._lock:
+            handle = self._db.execute(
+                "INSERT INTO site_traces (traces, created) VALUES (?, ?)", (json.dumps(traces), now)
+            ).lastrowid
+            self._db.execute(
+                "DELETE FROM site_traces WHERE created < ? OR handle <= ?",
+                (now - SITE_TRACES_TTL, handle - MAX_SITE_TRACES),
+            )
+        return handle
+
+    def site_traces(self, handle: int):
+        """
+        Get the traces of a multi-site trace handle.
+
+        :return: The traces, or None if the handle is unknown or expired.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT traces FROM site_traces WHERE handle=? AND created >= ?",
+                (handle, time.time() - SITE_TRACES_TTL),
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def entries(self, limit: int = 50) -> list[dict]:
+        """
+        List the stored results, most recently read first, without their values.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT kind, trace_id, entry_time, key, size, accessed FROM results ORDER BY accessed DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [
+            {"kind": kind, "trace_id": trace_id, "entry_time": entry_time, "key": key, "size": size, "accessed": accessed}
+            for kind, trace_id, entry_time, key, size, accessed in rows
+        ]
+
+    def purge(self, trace_id: int = None) -> int:
+        """
+        Delete the results of one trace, or all of them.
+
+        :return: Number of results deleted.
+        """
+        with self._lock:
+            if trace_id is None:
+                deleted = self._db.execute("DELETE FROM results").rowcount
+                self._db.execute("DELETE FROM device_traces")
+            else:
+                deleted = self._db.execute("DELETE FROM results WHERE trace_id=?", (trace_id,)).rowcount
+                self._db.execute("DELETE FROM device_traces WHERE trace_id=?", (trace_id,))
+        return deleted
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "entries": count,
+                "bytes": size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+def from_env() -> TraceResultStore:
+    """
+    Create the store configured by TRACE_STORE_PATH and TRACE_STORE_MAX_MB.
+    """
+    path = os.getenv("TRACE_STORE_PATH", DEFAULT_PATH)
+    max_bytes = int(float(os.getenv("TRACE_STORE_MAX_MB", DEFAULT_MAX_BYTES / (1024 * 1024))) * 1024 * 1024)
+    return TraceResultStore(path, max_bytes)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    store = from_env()
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if command == "stats":
+        print(json.dumps(store.stats(), indent=2))
+    elif command == "list":
+        limit = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+        print(json.dumps(store.entries(limit), indent=2))
+    elif command == "purge":
+        trace_id = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        print(store.purge(trace_id), "results deleted")
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,158 @@
+"""
+This module provides the response cache used by the vManage clients for read-only GET endpoints.
+
+Entries live for a TTL chosen per endpoint and are evicted least-recently-used
+once the cache is full. When an expired entry carries an ETag or Last-Modified
+validator, the next request revalidates it with If-None-Match/If-Modified-Since
+and a 304 answer refreshes the entry without downloading the body again.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+MAX_ENTRIES = 256
+
+# TTL in seconds per API path prefix. Endpoints not listed here are never cached.
+DEFAULT_TTLS = {
+    "/statistics/sitehealth/common": 60,
+    "/health/devices": 30,
+}
+
+
+class CachedResponse:
+    """
+    This class holds a cached vManage answer and exposes the parts of a response the NWPI parsers use.
+    """
+
+    __slots__ = ("status_code", "headers", "content", "expires_at", "_json")
+
+    def __init__(self, status_code: int, headers: dict, content: bytes, expires_at: float):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.expires_at = expires_at
+        self._json = None
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        # Decode once; every hit after that reuses the same object.
+        if self._json is None:
+            self._json = json.loads(self.content)
+        return self._json
+
+    def is_fresh(self) -> bool:
+        return time.monotonic() < self.expires_at
+
+    def validators(self) -> dict:
+        """
+        Build the conditional request headers for this entry.
+
+        :return: If-None-Match/If-Modified-Since headers, empty if vManage sent no validators.
+        """
+        headers = {}
+        if "ETag" in self.headers:
+            headers["If-None-Match"] = self.headers["ETag"]
+        if "Last-Modified" in self.headers:
+            headers["If-Modified-Since"] = self.headers["Last-Modified"]
+        return headers
+
+
+class ResponseCache:
+    """
+    This class is a thread-safe LRU cache of vManage GET responses with per-endpoint TTLs.
+    """
+
+    def __init__(self, ttls: dict = None, max_entries: int = MAX_ENTRIES):
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def ttl_for(self, path: str) -> int:
+        """
+        Get the TTL for an API path, 0 when the endpoint must not be cached.
+        """
+        endpoint = path.split("?", 1)[0]
+        for prefix, ttl in self.ttls.items():
+            if endpoint.startswith(prefix):
+                return ttl
+        return 0
+
+    def get(self, path: str):
+        """
+        Get the entry for a path, fresh or expired, and count the hit or miss.
+
+        :return: The cached entry or None.
+        """
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                self._entries.move_to_end(path)
+            if entry is not None and entry.is_fresh():
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry
+
+    def store(self, path: str, response) -> CachedResponse:
+        """
+        Store a 200 response for a path, evicting the least recently used entries above the size bound.
+
+        :param response: A requests or httpx response.
+        :return: The cached entry that replaces the response.
+        """
+        headers = {
+            name: response.headers[name]
+            for name in ("Content-Type", "ETag", "Last-Modified")
+            if name in response.headers
+        }
+        entry = CachedResponse(
+            response.status_code,
+            headers,
+            response.content,
+            time.monotonic() + self.ttl_for(path),
+        )
+        with self._lock:
+            self._entries[path] = entry
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def refresh(self, path: str, entry: CachedResponse) -> CachedResponse:
+        """
+        Extend the lifetime of an entry after vManage answered 304 Not Modified.
+        """
+        with self._lock:
+            entry.expires_at = time.monotonic() + self.ttl_for(path)
+            self.revalidations += 1
+        return entry
+
+    def invalidate(self, prefix: str = "") -> None:
+        """
+        Drop every entry whose path starts with the prefix, or all of them.
+        """
+        with self._lock:
+            for path in [p for p in self._entries if p.startswith(prefix)]:
+                del self._entries[path]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
@@ -0,0 +1,363 @@
+"""
+This module provides a vManage REST client shared by every NWPI tool.
+
+The client keeps one `requests.Session` with a keep-alive connection pool, so
+consecutive tool calls reuse the same TCP/TLS connection to vManage instead of
+paying a new handshake per request. It also owns the JSESSIONID cookie and the
+XSRF token, logs in lazily on the first request, and logs in again on its own
+when vManage reports that the session has expired. `AsyncVManageClient` offers the same behaviour on top of
+`httpx.AsyncClient` for the async tool variants. Both clients can share a
+`ResponseCache` for the read-only GET endpoints.
+"""
+import asyncio
+import contextlib
+import logging
+import threading
+
+import httpx
+import ijson
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from vmanage_cache import ResponseCache
+
+logger = logging.getLogger(__name__)
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 16
+REQUEST_TIMEOUT = 60
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class VManageAuthError(Exception):
+    """
+    Raised when vManage does not return a valid JSESSIONID.
+    """
+
+
+def is_session_expired(response) -> bool:
+    """
+    Check if a vManage response means the session is no longer valid.
+
+    vManage answers 401/403 when the XSRF token is rejected, and answers
+    200 with its HTML login page when the JSESSIONID has expired.
+    """
+    if response.status_code in (401, 403):
+        return True
+    if "text/html" not in response.headers.get("Content-Type", ""):
+        return False
+    return b"<html" in response.content[:512].lower()
+
+
+def iter_json_items(chunks, prefix: str):
+    """
+    Parse JSON incrementally and yield the objects found under a prefix as soon as they are complete.
+
+    :param chunks: Iterable of body chunks in bytes.
+    :param prefix: ijson prefix, e.g. "item" for a top-level list or "data.item".
+    """
+    items = ijson.sendable_list()
+    parser = ijson.items_coro(items, prefix, use_float=True)
+    for chunk in chunks:
+        parser.send(chunk)
+        yield from items
+        del items[:]
+    parser.close()
+    yield from items
+
+
+async def aiter_json_items(chunks, prefix: str):
+    """
+    Async counterpart of `iter_json_items` for an async iterable of body chunks.
+    """
+    items = ijson.sendable_list()
+    parser = ijson.items_coro(items, prefix, use_float=True)
+    async for chunk in chunks:
+        parser.send(chunk)
+        for item in items:
+            yield item
+        del items[:]
+    parser.close()
+    for item in items:
+        yield item
+
+
+class VManageClient:
+    """
+    This class encapsulates the connection pool and the authentication state for one vManage.
+    """
+
+    def __init__(self, host: str, port: str, username: str, password: str, cache: ResponseCache = None):
+        self.base_url = "https://%s:%s" % (host, port)
+        self.username = username
+        self.password = password
+        self.cache = cache
+        self.session = self._create_session()
+        self._auth_lock = threading.Lock()
+        self._auth_generation = 0
+
+    def _create_session(self) -> requests.Session:
+        """
+        Create a session with a keep-alive connection pool.
+
+        :return: The created session.
+        """
+        session = requests.Session()
+        session.verify = False
+        adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+        session.mount("https://", adapter)
+        session.headers.update({"Content-Type": "application/json"})
+        return session
+
+    @property
+    def is_authenticated(self) -> bool:
+        return self._auth_generation > 0
+
+    def login(self) -> None:
+        """
+        Get a new JSESSIONID and XSRF token and store them in the session.
+        """
+        with self._auth_lock:
+            self._login()
+
+    def ensure_login(self) -> None:
+        """
+        Log in unless a session was already established, only one thread logs in.
+        """
+        if self._auth_generation == 0:
+            self._reauthenticate(0)
+
+    def _login(self) -> None:
+        self.session.cookies.clear()
+        self.session.headers.pop("X-XSRF-TOKEN", None)
+
+        payload = {"j_username": self.username, "j_password": self.password}
+        response = self.session.post(
+            self.base_url + "/j_security_check",
+            data=payload,
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            timeout=REQUEST_TIMEOUT,
+        )
+        if "JSESSIONID" not in self.session.cookies or is_session_expired(response):
+            raise VManageAuthError("No valid JSESSION ID returned")
+
+        response = self.session.get(self.base_url + "/dataservice/client/token", timeout=REQUEST_TIMEOUT)
+        if response.status_code == 200:
+            self.session.headers["X-XSRF-TOKEN"] = response.text
+
+        self._auth_generation += 1
+        logger.info("VMANAGE_LOGIN: %s", self.base_url)
+
+    def _reauthenticate(self, seen_generation: int) -> None:
+        """
+        Log in again, unless another thread already did it after the failed request was sent.
+        """
+        with self._auth_lock:
+            if self._auth_generation == seen_generation:
+                self._login()
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        Send a request to vManage, logging in first if needed and again once if the session expired.
+
+        :param method: HTTP method.
+        :param path: API path relative to /dataservice, e.g. "/health/devices".
+        :return: The vManage response.
+        """
+        self.ensure_login()
+        url = self.base_url + "/dataservice" + path
+        kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+
+        generation = self._auth_generation
+        response = self.session.request(method, url, **kwargs)
+        if is_session_expired(response):
+            logger.info("VMANAGE_SESSION_EXPIRED: %s %s", method, path)
+            self._reauthenticate(generation)
+            response = self.session.request(method, url, **kwargs)
+        return response
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        """
+        Send a GET request, answering from the response cache when the endpoint is cacheable.
+        """
+        ttl = self.cache.ttl_for(path) if self.cache is not None else 0
+        if not ttl or kwargs:
+            return self.request("GET", path, **kwargs)
+
+        entry = self.cache.get(path)
+        if entry is not None and entry.is_fresh():
+            return entry
+        validators = entry.validators() if entry is not None else {}
+        response = self.request("GET", path, headers=validators)
+        if response.status_code == 304 and entry is not None:
+            return self.cache.refresh(path, entry)
+        if response.status_code == 200:
+            return self.cache.store(path, response)
+        return response
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    @contextlib.contextmanager
+    def stream(self, method: str, path: str, **kwargs):
+        """
+        Send a request without reading the body, so it can be parsed chunk by chunk.
+
+        :return: Context manager yielding the response, closed on exit.
+        """
+        response = self.request(method, path, stream=True, **kwargs)
+        try:
+            yield response
+        finally:
+            response.close()
+
+
+class AsyncVManageClient:
+    """
+    This class is the asyncio counterpart of `VManageClient`, built on `httpx.AsyncClient`.
+
+    It is used by the async variants of the NWPI tools, so `graph.ainvoke` can wait on
+    vManage without holding a worker thread per in-flight request.
+    """
+
+    def __init__(self, host: str, port: str, username: str, password: str, cache: ResponseCache = None):
+        self.base_url = "https://%s:%s" % (host, port)
+        self.username = username
+        self.password = password
+        self.cache = cache
+        self._client = None
+        self._auth_lock = asyncio.Lock()
+        self._auth_generation = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        Create the pooled `httpx.AsyncClient` on first use, inside the running event loop.
+        """
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                verify=False,
+                timeout=REQUEST_TIMEOUT,
+                limits=httpx.Limits(max_connections=POOL_MAXSIZE, max_keepalive_connections=POOL_MAXSIZE),
+                headers={"Content-Type": "application/json"},
+            )
+        return self._client
+
+    @property
+    def is_authenticated(self) -> bool:
+        return self._auth_generation > 0
+
+    async def login(self) -> None:
+        """
+        Get a new JSESSIONID and XSRF token and store them in the client.
+        """
+        async with self._auth_lock:
+            await self._login()
+
+    async def ensure_login(self) -> None:
+        if self._auth_generation == 0:
+            await self._reauthenticate(0)
+
+    async def _login(self) -> None:
+        self.client.cookies.clear()
+        self.client.headers.pop("X-XSRF-TOKEN", None)
+
+        payload = {"j_username": self.username, "j_password": self.password}
+        response = await self.client.post(
+            "/j_security_check",
+            data=payload,
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+        )
+        if "JSESSIONID" not in self.client.cookies or is_session_expired(response):
+            raise VManageAuthError("No valid JSESSION ID returned")
+
+        response = await self.client.get("/dataservice/client/token")
+        if response.status_code == 200:
+            self.client.headers["X-XSRF-TOKEN"] = response.text
+
+        self._auth_generation += 1
+        logger.info("VMANAGE_ASYNC_LOGIN: %s", self.base_url)
+
+    async def _reauthenticate(self, seen_generation: int) -> None:
+        async with self._auth_lock:
+            if self._auth_generation == seen_generation:
+                await self._login()
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """
+        Send a request to vManage, logging in first if needed and again once if the session expired.
+
+        :param method: HTTP method.
+        :param path: API path relative to /dataservice, e.g. "/health/devices".
+        :return: The vManage response.
+        """
+        await self.ensure_login()
+
+        url = "/dataservice" + path
+        generation = self._auth_generation
+        response = await self.client.request(method, url, **kwargs)
+        if is_session_expired(response):
+            logger.info("VMANAGE_SESSION_EXPIRED: %s %s", method, path)
+            await self._reauthenticate(generation)
+            response = await self.client.request(method, url, **kwargs)
+        return response
+
+    async def get(self, path: str, **kwargs) -> httpx.Response:
+        """
+        Send a GET request, answering from the response cache when the endpoint is cacheable.
+        """
+        ttl = self.cache.ttl_for(path) if self.cache is not None else 0
+        if not ttl or kwargs:
+            return await self.request("GET", path, **kwargs)
+
+        entry = self.cache.get(path)
+        if entry is not None and entry.is_fresh():
+            return entry
+        validators = entry.validators() if entry is not None else {}
+        response = await self.request("GET", path, headers=validators)
+        if response.status_code == 304 and entry is not None:
+            return self.cache.refresh(path, entry)
+        if response.status_code == 200:
+            return self.cache.store(path, response)
+        return response
+
+    async def post(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", path, **kwargs)
+
+    async def _send_stream(self, method: str, url: str, **kwargs) -> httpx.Response:
+        response = await self.client.send(self.client.build_request(method, url, **kwargs), stream=True)
+        if response.status_code in (401, 403) or "text/html" in response.headers.get("Content-Type", ""):
+            # Only error pages are read up front, to tell an expired session apart
+            await response.aread()
+        return response
+
+    @contextlib.asynccontextmanager
+    async def stream(self, method: str, path: str, **kwargs):
+        """
+        Send a request without reading the body, so it can be parsed chunk by chunk.
+
+        :return: Async context manager yielding the response, closed on exit.
+        """
+        await self.ensure_login()
+
+        url = "/dataservice" + path
+        generation = self._auth_generation
+        response = await self._send_stream(method, url, **kwargs)
+        if response.is_stream_consumed and is_session_expired(response):
+            logger.info("VMANAGE_SESSION_EXPIRED: %s %s", method, path)
+            await response.aclose()
+            await self._reauthenticate(generation)
+            response = await self._send_stream(method, url, **kwargs)
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -16,14 +16,20 @@ from webexteamssdk.models.cards import (
     FactSet,
 )
 
+import time
+from webexteamssdk import WebexTeamsAPI
+
+from load_global_settings import WEBEX_TEAMS_ACCESS_TOKEN
 from logging_config.main import setup_logging
-from webex.chat_api_client import send_message_to_chat_api
+from webex.chat_api_client import stream_message_to_chat_api
 
 logger = setup_logging()
 
 
 OPENAI_ICON = "https://github.com/fbradyirl/fbradyirl.github.io/raw/master/static/img/OpenAI_logo-100x70-rounded.png"
 CARD_CALLBACK_MORE_INFO = "help"
+# Minimum seconds between two progress messages about tools, worker answers are always posted
+PROGRESS_INTERVAL = 10
 
 
 class AiCommand(Command):
@@ -33,14 +39,58 @@ class AiCommand(Command):
             help_message="Interact with an AI based on OpenAI's GPT-4o.",
             chained_commands=[AiMoreInfoCallback()],
         )
+        self.webex_api = WebexTeamsAPI(access_token=WEBEX_TEAMS_ACCESS_TOKEN)
+
+    def pre_execute(self, message, attachment_actions, activity):
+        return quote_info("Working on it 🔎, I'll post progress here.")
 
     def execute(self, message, attachment_actions, activity):
         logger.info(f"Got message prompt from user: {message}. Reviewing ")
-        response = send_message_to_chat_api(message=message)
+        # webex_bot passes the incoming teams message as attachment_actions
+        progress = ProgressReporter(self.webex_api, getattr(attachment_actions, "roomId", None))
+        # One conversation memory per room and user
+        session_id = f"webex:{getattr(attachment_actions, 'roomId', '')}:{getattr(attachment_actions, 'personEmail', '')}"
+        response = stream_message_to_chat_api(message=message, on_event=progress.on_event, session_id=session_id)
         logger.info(f"OpenAI response: {response}")
         return [quote_info(response)]
 
 
+class ProgressReporter:
+    """
+    This class posts the progress events of a streamed chat to a Webex room.
+    """
+
+    def __init__(self, webex_api: WebexTeamsAPI, room_id: str):
+        self.webex_api = webex_api
+        self.room_id = room_id
+        self.last_post = 0.0
+
+    def on_event(self, event: str, data: dict) -> None:
+        if event == "message" and data.get("node") == "Tracer" and data.get("content"):
+            self.post(f"🛰️ Tracer: {data['content']}", force=True)
+        elif event == "node_start":
+            self.post(f"⏳ {data['node']} is working...")
+        elif event == "tool_start":
+            self.post(f"🔧 {data['node']} is running {data['tool']}...")
+        elif event == "resumed":
+            self.post(f"↩️ Your previous request was interrupted, here is its answer:\n{data['content']}", force=True)
+        elif event == "error":
+            self.post(f"⚠️ {data['message']}", force=True)
+
+    def post(self, markdown: str, force: bool = False) -> None:
+        if self.room_id is None:
+            return
+        now = time.monotonic()
+        if not force and now - self.last_post < PROGRESS_INTERVAL:
+            return
+        self.last_post = now
+        try:
+            self.webex_api.messages.create(roomId=self.room_id, markdown=markdown)
+        except Exception as e:
+            # Progress is best effort, the final answer is still returned by execute
+            logger.warning(f"PROGRESS_POST_FAILED: {e}")
+
+
 class AiMoreInfoCallback(Command):
     def __init__(self):
         super().__init__(
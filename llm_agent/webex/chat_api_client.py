@@ -1,3 +1,4 @@
+import json
 import requests
 
 from load_global_settings import (
@@ -8,20 +9,24 @@ from load_global_settings import (
 import requests
 
 NUMBER_OF_TRIES_TO_CONNECT = 3
+# Seconds to wait for the first byte of the stream, the stream itself has no timeout
+STREAM_CONNECT_TIMEOUT = 10
+STREAM_READ_TIMEOUT = 120
 
 
-def send_message_to_chat_api(message: str) -> str:
+def send_message_to_chat_api(message: str, session_id: str = None) -> str:
     """
     Sends a message to the chat API and returns the response.
 
     Args:
         message (str): The message to send.
+        session_id (str): Optional - Session whose conversation memory the agents use.
 
     Returns:
         str: The response from the API, or an error message if the request failed.
     """
     url = f"http://{HOST_URL}:{LLM_HTTP_PORT}/chat"
-    data = {"message": message}
+    data = {"message": message, "session_id": session_id}
     for _ in range(NUMBER_OF_TRIES_TO_CONNECT):  # try twice
         try:
             response = requests.post(url, json=data, timeout=120)
@@ -33,4 +38,63 @@ def send_message_to_chat_api(message: str) -> str:
                 )
         except requests.exceptions.RequestException as e:
             print(f"Request failed: {e}")
-        return "Ouch, Error connecting webex to LLM. try again."
\ No newline at end of file
+        return "Ouch, Error connecting webex to LLM. try again."
+
+
+def stream_message_to_chat_api(message: str, on_event=None, session_id: str = None) -> str:
+    """
+    Sends a message to the streaming chat API and returns the final answer.
+
+    Args:
+        message (str): The message to send.
+        on_event (callable): Optional - Called with (event, data) for every progress event as it arrives.
+        session_id (str): Optional - Session whose conversation memory the agents use.
+
+    Returns:
+        str: The final answer, or an error message if the request failed.
+    """
+    url = f"http://{HOST_URL}:{LLM_HTTP_PORT}/chat/stream"
+    data = {"message": message, "session_id": session_id}
+    for _ in range(NUMBER_OF_TRIES_TO_CONNECT):
+        started = False
+        try:
+            with requests.post(
+                url, json=data, stream=True, timeout=(STREAM_CONNECT_TIMEOUT, STREAM_READ_TIMEOUT)
+            ) as response:
+                started = True
+                if response.status_code != 200:
+                    print(
+                        f"Error: http status code: {response.status_code}, http response: {response.text}"
+                    )
+                    return "Ouch, Error connecting webex to LLM. try again."
+                for event, payload in iter_sse(response.iter_lines(decode_unicode=True)):
+                    if event == "final":
+                        return payload.get("content") or "Ouch, Error connecting webex to LLM. try again."
+                    if on_event is not None:
+                        on_event(event, payload)
+            # The stream ended with an error event, or without an answer
+            return "Ouch, Error connecting webex to LLM. try again."
+        except requests.exceptions.RequestException as e:
+            print(f"Request failed: {e}")
+            # Only a failed connection is tried again, the request must not run twice
+            if started or not isinstance(e, requests.exceptions.ConnectionError):
+                break
+    return "Ouch, Error connecting webex to LLM. try again."
+
+
+def iter_sse(lines):
+    """
+    Parse Server-Sent Events lines into (event, data) pairs, data decoded from JSON.
+    """
+    event = "message"
+    data = []
+    for line in lines:
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event = "message"
+            data = []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())